@@ -1,705 +1,52 @@
-import dataclasses
 import math as m
-import random
-from enum import Enum
-from typing import TypeVar, Any, Iterable, Annotated, Literal
-import itertools
-import traceback
-import copy
+import sys
 import numpy as np
-import numpy.typing as npt
 from datetime import datetime
 
 import obj_parser as obj  # pyright: ignore
 import gif_exporter as gif_exporter
-
-import pyxel
-
-
-T = TypeVar("T")
-
-DType = TypeVar("DType", bound=np.generic)
-Mat4 = Annotated[npt.NDArray[DType], Literal[4, 4]]
-Vec3 = Annotated[npt.NDArray[DType], Literal[3]]
-Vec4 = Annotated[npt.NDArray[DType], Literal[4]]
-
-
-WIDTH = 160
-HEIGHT = 120
-FPS = 15
-
-BLUE = 1
-PURPLE = 2
-TEAL = 3
-ORANGE = 9
-
-
-@dataclasses.dataclass
-class Buffer:
-    contents: list[Any]
-    width: int
-    height: int
-
-    def __init__(self, width: int, height: int, initial_value: Any):
-        self.width = width
-        self.height = height
-        self.contents = [initial_value] * (width * height)
-
-    def get_index(self, x: int, y: int):
-        if x >= self.width or x < 0:
-            # print(f"x is out of range: {x=},{y=}")
-            raise Exception(f"x is out of range: {x=},{y=}")
-
-        if y >= self.height or y < 0:
-            # print(f"x is out of range: {x=},{y=}")
-            raise Exception(f"y is out of range: {x=},{y=}")
-
-        return y * self.width + x
-
-    def set(self, x: int, y: int, value: Any):
-        try:
-            index = self.get_index(x, y)
-            self.contents[index] = value
-        except:
-            pass
-            # print(f"tried to set x or y out of range: {x=},{y=}")
-
-    def get(self, x: int, y: int) -> Any:
-        try:
-            index = self.get_index(x, y)
-        except ():
-            # print(f"tried to get x or y out of range: {x=},{y=}")
-            traceback.print_exc()
-            return 0
-        return self.contents[index]
-
-    def set_cartesian(self, cartX: int, cartY: int, value: Any):
-        # may not work well, different behaviour coule happen with even/odd width/height
-        x = cartX + self.width // 2
-        y = (-1 * cartY) + self.height // 2
-        self.set(x, y, value)
-
-    def get_cartesian(self, cartX: int, cartY: int) -> Any:
-        # may not work well, different behaviour coule happen with even/odd width/height
-        x = cartX + self.width // 2
-        y = (-1 * cartY) + self.height // 2
-        # print(f"get_cartesian {cartX=}, {cartY=}, {x=},{y=}, {self.width=}")
-        return self.get(x, y)
-
-    # should we find min/max and only draw those pixels
-    def draw(self):
-        if isinstance(self.contents[0], int):
-            for x in range(self.width):
-                for y in range(self.height):
-                    pyxel.pset(x, y, self.get(x, y))
-
-        if isinstance(self.contents[0], float):
-            for x in range(self.width):
-                for y in range(self.height):
-                    z = self.get(x, y)
-                    if z == float("inf"):
-                        color = 0
-                    else:
-                        color = z_pallette[int((z / 6 % len(z_pallette)))]
-                    pyxel.pset(x, y, color)
-
-
-z_pallette = [8, 9, 10, 11, 12, 5, 1, 2]
-
-
-@dataclasses.dataclass
-class Point:
-    x: float
-    y: float
-    z: float
-
-    def __repr__(self):
-        return f" x  = {self.x:10.2f} y = {self.y:10.2f} z = {self.z:10.2f}"
-
-    def as_tuple(self):
-        return (self.x, self.y, self.z)
-
-    def __sub__(self, other):
-        deltaX = self.x - other.x
-        deltaY = self.y - other.y
-        deltaZ = self.z - other.z
-        return Point(deltaX, deltaY, deltaZ)
-
-    def length(self):
-        return m.sqrt(self.x**2 + self.y**2 + self.z**2)
-
-
-@dataclasses.dataclass
-class Line:
-    p1: Point
-    p2: Point
-
-    def x(self, y: float) -> float:
-        p1 = self.p1
-        p2 = self.p2
-        if p1.x == p2.x:
-            return p1.x
-
-        slope = (p1.y - p2.y) / (p1.x - p2.x)
-        b = p2.y - (slope * p2.x)
-        return (y - b) / slope
-
-
-def argmin(a):
-    return min(range(len(a)), key=lambda x: a[x])
-
-
-def argmax(a):
-    return max(range(len(a)), key=lambda x: a[x])
-
-
-class TriType(Enum):
-    UP = 0
-    DOWN = 1
-    STANDARD = 2
-    HORIZONTAL_LINE = 3
-    VERTICAL_LINE = 4
-
-
-def tris_from_verts(
-    vertices: list[Vec4], faces: list[list[int]]
-) -> list[list[tuple[float, float, float]]]:
-    tris = []
-    for face in faces:
-        tris.append(
-            [
-                vertices[face[0]][:3],
-                vertices[face[1]][:3],
-                vertices[face[2]][:3],
-            ]
-        )
-    return tris
-
-
-def mat_times_vec(
-    mat: list[list[float]], vec: tuple[float, float, float, float]
-) -> list[float]:
-    xp = dot(vec, mat[0])
-    yp = dot(vec, mat[1])
-    zp = dot(vec, mat[2])
-    wp = dot(vec, mat[3])
-    return [xp, yp, zp, wp]
-
-
-def transform_verts(verts: list[Vec4], transform: Mat4):
-    new_verts = [v.copy() for v in verts]
-    for i, v in enumerate(verts):
-        new_verts[i] = transform @ v
-    return new_verts
-
-
-def tranpose(mat: list[list[float]]) -> list[list[float]]:
-    # does not work :(
-    return [[mat[j][i] for i, j in itertools.product(range(4), repeat=2)]]
-
-
-def dot(v1: Iterable[float], v2: Iterable[float]) -> float:
-    elementwise = [a * b for a, b in zip(v1, v2)]
-    return sum(elementwise)
-
-
-def create_test_mat(size: int):
-    mat = [list((i, i + size)) for i in range(0, size**2, size)]
-    return [float(mat[i][j]) for i, j in itertools.product(range(4), repeat=2)]
-
-
-def characterize_tri(tri: list[tuple[float, float, float]]) -> TriType:
-    p1 = Point(*tri[0])
-    p2 = Point(*tri[1])
-    p3 = Point(*tri[2])
-    # you can chain things 0.o
-    if p1.x == p2.x == p3.x:
-        # print("All 3 x values are equal. I can't draw that!")
-        raise Exception("All 3 x values are equal. I can't draw that!")
-    if p1.y == p2.y == p3.y:
-        # print("All 3 y values are equal. I can't draw that!")
-        # print(f"{p1=}\n{p2=}\n{p3=}")
-        raise Exception("All 3 y values are equal. I can't draw that!")
-
-    if p1.y == p2.y:
-        pOffLine = p3
-        line_y_location = p1.y
-    elif p1.y == p3.y:
-        pOffLine = p2
-        line_y_location = p1.y
-    elif p2.y == p3.y:
-        pOffLine = p1
-        line_y_location = p2.y
-    else:
-        return TriType.STANDARD
-
-    if pOffLine.y > line_y_location:
-        return TriType.UP
-    else:
-        return TriType.DOWN
-
-
-def z_vornoi_estimate(p1: Point, p2: Point, p3: Point, pUnkown: Point) -> float:
-    deltaP1 = p1 - pUnkown
-    distanceP1 = deltaP1.length()
-
-    deltaP2 = p2 - pUnkown
-    distanceP2 = deltaP2.length()
-
-    deltaP3 = p3 - pUnkown
-    distanceP3 = deltaP3.length()
-
-    closestPointIndex = argmin([distanceP1, distanceP2, distanceP3])
-    closestPoint = [p1, p2, p3][closestPointIndex]
-    return closestPoint.z
-
-
-def z_estimate(p1: Point, p2: Point, p3: Point, pUnkown: Point) -> float:
-    w1 = ((p2.y - p3.y) * (pUnkown.x - p3.x) + (p3.x - p2.x) * (pUnkown.y - p3.y)) / (
-        (p2.y - p3.y) * (p1.x - p3.x) + (p3.x - p2.x) * (p1.y - p3.y)
-    )
-
-    w2 = ((p3.y - p1.y) * (pUnkown.x - p3.x) + (p1.x - p3.x) * (pUnkown.y - p3.y)) / (
-        (p2.y - p3.y) * (p1.x - p3.x) + (p3.x - p2.x) * (p1.y - p3.y)
-    )
-
-    w3 = 1 - w1 - w2
-
-    z_weighted_average = p1.z * w1 + p2.z * w2 + p3.z * w3
-    # print(f"{w1=} {w2=} {w3=}")
-    # print(f"{z_weighted_average=}")
-    return z_weighted_average
-
-
-def draw_tri(tri: list[tuple[float, float, float]], color: int):
-    # trying to sort for debugging z value dependence on order
-    tri = sorted(tri, key=lambda p: p[1])
-    points_to_process = tri[:]
-
-    p1 = Point(*tri[0])
-    p2 = Point(*tri[1])
-    p3 = Point(*tri[2])
-
-    y_min = min(p1.y, p2.y, p3.y)
-    y_max = max(p1.y, p2.y, p3.y)
-
-    try:
-        tri_type = characterize_tri(tri)
-    except:
-        # print("couldn't characterize triangle to a drawable type")
-        # print("unidentifiable triangle:")
-        # print(p1, p2, p3, sep="\n")
-        return
-
-    # print(f"{tri_type=}")
-    # print(p1,p2,p3,sep="\n")
-
-    if tri_type == TriType.DOWN:
-        bottom_vertex_index = argmin([p1.y, p2.y, p3.y])
-        bottom = Point(*tri[bottom_vertex_index])
-        del points_to_process[bottom_vertex_index]
-
-        xs = [p[0] for p in points_to_process]
-        left_vertex_index = argmin(xs)
-        left = Point(*points_to_process[left_vertex_index])
-        del points_to_process[left_vertex_index]
-
-        right = Point(*points_to_process[0])
-
-        # Find line on the left side
-        line_l = Line(left, bottom)
-        # Find line on the right side
-        line_r = Line(bottom, right)
-    elif tri_type == TriType.UP:
-        top_vertex_index = argmax([p1.y, p2.y, p3.y])
-        top = Point(*tri[top_vertex_index])
-        del points_to_process[top_vertex_index]
-
-        xs = [p[0] for p in points_to_process]
-        left_vertex_index = argmin(xs)
-        left = Point(*points_to_process[left_vertex_index])
-        del points_to_process[left_vertex_index]
-
-        right = Point(*points_to_process[0])
-
-        # Find line on the left side
-        line_l = Line(left, top)
-        # Find line on the right side
-        line_r = Line(top, right)
-
-    elif tri_type == TriType.STANDARD:
-        points_sorted_vertically = sorted([p1, p2, p3], key=lambda p: p.y)
-        pBottom = points_sorted_vertically[0]
-        pMiddle = points_sorted_vertically[1]
-        pTop = points_sorted_vertically[2]
-
-        opposite_line = Line(pBottom, pTop)
-        pNew = Point(
-            opposite_line.x(pMiddle.y),
-            pMiddle.y,
-            ((pTop.z + pMiddle.z + pBottom.z) / 3),
-        )  # TODO use a weighted average (by distance), this will proabably break in some cases
-        topTri = [pMiddle.as_tuple(), pNew.as_tuple(), pTop.as_tuple()]
-        botTri = [pMiddle.as_tuple(), pNew.as_tuple(), pBottom.as_tuple()]
-
-        draw_tri(topTri, color)
-        draw_tri(botTri, color)
-        return
-
-    else:
-        raise Exception("I don't know how to draw anything else")
-
-    for y in range(m.ceil(y_min), m.floor(y_max) + 1):
-        x_min = line_l.x(y)
-        x_max = line_r.x(y)
-
-        for x in range(m.ceil(x_min), m.floor(x_max) + 1):
-            z = z_estimate(p1, p2, p3, Point(x, y, 0.0))
-            if z <= z_buffer.get_cartesian(x, y):
-                pixel_buffer.set_cartesian(x, y, color)
-                z_buffer.set_cartesian(x, y, z)
-
-
-def create_down_square_tris(num_tris: int) -> list[list[tuple[int, int]]]:
-    test_tris = []
-    for _ in range(num_tris):
-        rand_x1 = random.randint(-WIDTH // 2, WIDTH // 2)
-        rand_x2 = random.randint(-WIDTH // 2, WIDTH // 2)
-        xmin = min(rand_x1, rand_x2)
-        xmax = max(rand_x1, rand_x2)
-        if xmin == xmax:
-            xmax += 1
-
-        rand_y1 = random.randint(-HEIGHT // 2, HEIGHT // 2)
-        rand_y2 = random.randint(-HEIGHT // 2, HEIGHT // 2)
-        ymin = min(rand_y1, rand_y2)
-        ymax = max(rand_y1, rand_y2)
-        if ymin == ymax:
-            ymax += 1
-
-        x1 = xmin
-        y1 = ymax
-        x2 = xmax
-        y2 = ymax
-        x3 = random.choice([xmax, xmin])
-        y3 = ymin
-
-        tri = [(x1, y1), (x2, y2), (x3, y3)]
-        random.shuffle(tri)
-
-        test_tris.append(tri)
-    return test_tris
-
-
-def create_down_tris(num_tris: int) -> list[list[tuple[int, int]]]:
-    test_tris = []
-    for _ in range(num_tris):
-        rand_x1 = random.randint(-WIDTH // 2, WIDTH // 2)
-        rand_x2 = random.randint(-WIDTH // 2, WIDTH // 2)
-        rand_x3 = random.randint(-WIDTH // 2, WIDTH // 2)
-        xmin = min(rand_x1, rand_x2)
-        xmax = max(rand_x1, rand_x2)
-        if xmin == xmax:
-            xmax += 1
-
-        rand_y1 = random.randint(-HEIGHT // 2, HEIGHT // 2)
-        rand_y2 = random.randint(-HEIGHT // 2, HEIGHT // 2)
-        ymin = min(rand_y1, rand_y2)
-        ymax = max(rand_y1, rand_y2)
-        if ymin == ymax:
-            ymax += 1
-
-        x1 = xmin
-        y1 = ymax
-        x2 = xmax
-        y2 = ymax
-        x3 = rand_x3
-        y3 = ymin
-
-        tri = [(x1, y1), (x2, y2), (x3, y3)]
-        random.shuffle(tri)
-
-        test_tris.append(tri)
-    return test_tris
-
-
-def create_up_tris(num_tris: int) -> list[list[tuple[int, int]]]:
-    test_tris = []
-    for _ in range(num_tris):
-        rand_x1 = random.randint(-WIDTH // 2, WIDTH // 2)
-        rand_x2 = random.randint(-WIDTH // 2, WIDTH // 2)
-        rand_x3 = random.randint(-WIDTH // 2, WIDTH // 2)
-        xmin = min(rand_x1, rand_x2)
-        xmax = max(rand_x1, rand_x2)
-        if xmin == xmax:
-            xmax += 1
-
-        rand_y1 = random.randint(-HEIGHT // 2, HEIGHT // 2)
-        rand_y2 = random.randint(-HEIGHT // 2, HEIGHT // 2)
-        ymin = min(rand_y1, rand_y2)
-        ymax = max(rand_y1, rand_y2)
-        if ymin == ymax:
-            ymax += 1
-
-        x1 = xmin
-        y1 = ymin
-        x2 = xmax
-        y2 = ymin
-        x3 = rand_x3
-        y3 = ymax
-
-        tri = [(x1, y1), (x2, y2), (x3, y3)]
-        random.shuffle(tri)
-
-        test_tris.append(tri)
-    return test_tris
-
-
-def create_standard_tris(num_tris: int) -> list[list[tuple[int, int]]]:
-    test_tris = []
-    for _ in range(num_tris):
-        x1 = random.randint(-WIDTH // 2, WIDTH // 2)
-        x2 = random.randint(-WIDTH // 2, WIDTH // 2)
-        x3 = random.randint(-WIDTH // 2, WIDTH // 2)
-
-        y1 = random.randint(-HEIGHT // 2, HEIGHT // 2)
-        y2 = random.randint(-HEIGHT // 2, HEIGHT // 2)
-        y3 = random.randint(-HEIGHT // 2, HEIGHT // 2)
-
-        tri = [(x1, y1), (x2, y2), (x3, y3)]
-        random.shuffle(tri)
-
-        test_tris.append(tri)
-    return test_tris
-
-
-# z pos
-# back 100
-# middle 60
-# front 20
-niave_cube_verts: list[Vec4] = [
-    np.array((*vec, 1.0), dtype=float)
-    for vec in [
-        (40, 30, 60),
-        (0, -40, 20),
-        (-40, -20, 60),
-        (0, 0, 100),
-        (40, -20, 60),
-        (0, 10, 20),
-        (-40, 30, 60),
-        (0, 50, 100),
-    ]
-]
-
-niave_cube_faces = [
-    [1, 4, 3],
-    [1, 2, 3],  # bottom
-    [5, 0, 4],
-    [5, 1, 4],  # front right
-    [5, 6, 2],
-    [5, 1, 2],  # front left
-    [2, 6, 7],
-    [2, 3, 7],  # back left
-    [3, 7, 0],
-    [3, 4, 0],  # back right
-    [5, 6, 7],
-    [5, 0, 7],  # top
-]
-
-cube_verts: list[Vec4] = [
-    np.array((*vec, 1.0), dtype=float)
-    for vec in [
-        (0, 0, 0),
-        (0, 0, 1),
-        (0, 1, 0),
-        (0, 1, 1),
-        (1, 0, 0),
-        (1, 0, 1),
-        (1, 1, 0),
-        (1, 1, 1),
-    ]
-]
-
-
-cube_faces = [
-    [0, 1, 2],  # x 0 face
-    [1, 2, 3],
-    [4, 5, 6],  # x 1 face
-    [5, 6, 7],
-    [0, 1, 4],  # y 0 face
-    [1, 4, 5],
-    [2, 3, 6],  # y 1 face
-    [3, 6, 7],
-    [0, 2, 4],  # z 0 face
-    [2, 4, 6],
-    [1, 3, 5],  # z 1 face
-    [3, 5, 7],
-]
-
-
-cube_colors = [
-    pyxel.COLOR_PINK,
-    pyxel.COLOR_PINK,
-    pyxel.COLOR_LIGHT_BLUE,
-    pyxel.COLOR_LIGHT_BLUE,
-    pyxel.COLOR_LIME,
-    pyxel.COLOR_LIME,
-    pyxel.COLOR_YELLOW,
-    pyxel.COLOR_YELLOW,
-    pyxel.COLOR_PURPLE,
-    pyxel.COLOR_PURPLE,
-    pyxel.COLOR_GRAY,
-    pyxel.COLOR_GRAY,
-]
-
-test_colors = [
-    pyxel.COLOR_PINK,
-    pyxel.COLOR_PURPLE,
-]
-
-test_faces = [
-    [0, 1, 2],
-    [0, 2, 4],
-]
-
-# old_cube_tris = [
-#     [(0, 0), (0, -40), (40, -20)],
-#     [(0, 0), (0, -40), (-40, -20)],  # bottom
-#     [(0, 10), (40, 30), (40, -20)],
-#     [(0, 10), (0, -40), (40, -20)],  # front right
-#     [(0, 10), (-40, 30), (-40, -20)],
-#     [(0, 10), (0, -40), (-40, -20)],  # front left
-#     [(0, 0), (40, -20), (40, 30)],
-#     [(0, 0), (0, 50), (40, 30)],  # back right
-#     [(0, 0), (-40, -20), (-40, 30)],
-#     [(0, 0), (0, 50), (-40, 30)],  # back left
-#     [(0, 50), (0, 10), (40, 30)],
-#     [(0, 10), (0, 10), (-40, 30)],  # bottom
-# ]
-
-# test_tris = [[(11, 11), (1, 11), (1, 1)], [(20, 60), (0, 60), (20, 20)]]
-# test_tris = create_down_tris(30)
-# test_tris = [[(-25,-25),(50,50),(5,60)]]
-# test_tris = create_standard_tris(30)
-
-
-def createRotationX(angle):
-    return np.array(
-        [
-            [m.cos(angle), m.sin(angle), 0.0, 0.0],
-            [-m.sin(angle), m.cos(angle), 0.0, 0.0],
-            [0.0, 0.0, 1.0, 0.0],
-            [0.0, 0.0, 0.0, 1.0],
-        ],
-        dtype=float,
-    )
-
-
-def createRotationZ(angle):
-    return np.array(
-        [
-            [1.0, 0.0, 0.0, 0.0],
-            [0.0, m.cos(angle), m.sin(angle), 0.0],
-            [0.0, -m.sin(angle), m.cos(angle), 0.0],
-            [0.0, 0.0, 0.0, 1.0],
-        ],
-        dtype=float,
-    )
-
-
-def createRotationY(angle):
-    return np.array(
-        [
-            [m.cos(angle), 0.0, m.sin(angle), 0.0],
-            [0.0, 1.0, 0.0, 0.0],
-            [-m.sin(angle), 0.0, m.cos(angle), 0.0],
-            [0.0, 0.0, 0.0, 1.0],
-        ],
-        dtype=float,
-    )
-
-
-def createTranslation(x, y, z):
-    return np.array(
-        [
-            [1.0, 0.0, 0.0, x],
-            [0.0, 1.0, 0.0, y],
-            [0.0, 0.0, 1.0, z],
-            [0.0, 0.0, 0.0, 1.0],
-        ],
-        dtype=float,
-    )
-
-
-def createScale(xf, yf, zf):
-    return np.array(
-        [
-            [xf, 0.0, 0.0, 0.0],
-            [0.0, yf, 0.0, 0.0],
-            [0.0, 0.0, zf, 0.0],
-            [0.0, 0.0, 0.0, 1.0],
-        ],
-        dtype=float,
-    )
-
-
-identity = np.array(
-    [
-        [1.0, 0.0, 0.0, 0.0],
-        [0.0, 1.0, 0.0, 0.0],
-        [0.0, 0.0, 1.0, 0.0],
-        [0.0, 0.0, 0.0, 1.0],
-    ],
-    dtype=float,
-)
-rot90z = np.array(
-    [
-        [0.0, 1.0, 0.0, 0.0],
-        [-1.0, 0.0, 0.0, 0.0],
-        [0.0, 0.0, 1.0, 0.0],
-        [0.0, 0.0, 0.0, 1.0],
-    ],
-    dtype=float,
+from scene import Node, Scene, Shape
+from renderer import (
+    WIDTH,
+    HEIGHT,
+    FPS,
+    Buffer,
+    Camera,
+    CullStats,
+    FaceArray,
+    Point,
+    TransformStage,
+    TriArray,
+    VertArray,
+    colors_rgb,
+    createRotationX,
+    createRotationY,
+    createRotationZ,
+    createScale,
+    createTranslation,
+    cull_tris,
+    dirty_rect,
+    dither_shades,
+    draw_tri,
+    draw_tri_edge,
+    draw_tris,
+    face_normals,
+    identity,
+    light_instances,
+    nearest_palette_colors,
+    shade_colors,
+    turntable_transform,
 )
 
-rot90x = np.array(
-    [
-        [1.0, 0.0, 0.0, 0.0],
-        [0.0, 0.0, 1.0, 0.0],
-        [0.0, -1.0, 0.0, 0.0],
-        [0.0, 0.0, 0.0, 1.0],
-    ],
-    dtype=float,
-)
+import pyxel
 
-# TODO: don't hard code palette
-# print("Palette color 15")
-# print(pyxel.colors[15])
-# red = pyxel.colors[15]//(256*256)
-# green = (pyxel.colors[15]//256)%256
-# blue = pyxel.colors[15]%256
-# print(red, green, blue)
-colors_rgb = [
-    (0, 0, 0),
-    (43, 51, 95),
-    (126, 32, 114),
-    (25, 149, 156),
-    (139, 72, 82),
-    (57, 92, 152),
-    (169, 193, 255),
-    (238, 238, 238),
-    (212, 24, 108),
-    (211, 132, 65),
-    (233, 195, 91),
-    (112, 198, 169),
-    (118, 150, 222),
-    (163, 163, 163),
-    (255, 151, 152),
-    (237, 199, 176),
+obj_file = "./assets/porygon/model.obj"
+obj_mesh = obj.load_mesh(obj_file)
+obj_tris, obj_faces = obj_mesh.positions, obj_mesh.faces
+# palette color of each triangle, from its material
+obj_colors = nearest_palette_colors(obj.material_colors(obj_file, obj_mesh))[
+    obj_mesh.material_ids
 ]
-transform = rot90x
-
-obj_tris, obj_faces = obj.load("./assets/porygon/model.obj")
 
 
 # print(obj_tris,obj_faces)
@@ -709,21 +56,63 @@ class App:
     ran: bool = False
     show_z_buffer: bool = False
     animate_construction: bool = False
-    src_verts: list[Vec4] = obj_tris
-    # render_verts: list[Vec4] = copy.deepcopy(src_verts) # TODO do we need th raw vertices?
-    faces: list[list[int]] = obj_faces
-    transformed_verts: list[Vec4] = []
-    render_tris = []
+    # the frame the model is held at while animate_construction builds it up
+    construction_frame: int = 0
+    edge_rasterizer: bool = False
+    # the porygon mesh is closed and consistently wound, so back faces can go
+    culling: bool = True
+    show_cull_stats: bool = False
+    cull_stats: CullStats = CullStats()
+    src_verts: VertArray = obj_tris
+    faces: FaceArray = obj_faces
+    face_colors: np.ndarray = obj_colors
+    lighting: bool = True
+    dithering: bool = False
+    # model space normal of each face, and how lit it is this frame
+    src_normals: np.ndarray
+    face_intensities: np.ndarray
+    # palette color of every face this frame, indexed like face_intensities
+    render_colors: np.ndarray
+    transform_stage: TransformStage
+    render_tris: TriArray
+    # the face each of render_tris came from, indexing face_intensities
+    render_face_ids: np.ndarray
+    # the two copies of the mesh cube_update and test_update draw
+    scene: Scene | None = None
+    pixel_buffer: Buffer
+    z_buffer: Buffer
+    # which face each pixel came from, for dithering
+    face_buffer: Buffer
     frame_count: int = 0
     step_through_mode: bool = False
     mouse_z = 0
-    recording_gif = False
-    gif_data: list[list[int]] = []
+    # frames are written to the gif as they are drawn while recording
+    gif_writer: gif_exporter.GifWriter | None = None
+    # draws the screen in tiles on other processes when set, into its own
+    # shared buffers which replace pixel_buffer and z_buffer
+    tiler = None
+    # perspective when set, otherwise the scene is drawn orthographic
+    camera: Camera | None = None
+    # the triangles in the buffers and the settings they were drawn with, so
+    # a frame that only adds triangles can draw just those
+    drawn_tris: TriArray | None = None
+    drawn_settings: tuple = ()
 
     def __init__(self) -> None:
         pyxel.init(WIDTH, HEIGHT, fps=FPS)
 
-        self.render_tris = tris_from_verts(self.src_verts, self.faces)
+        self.pixel_buffer = Buffer(WIDTH, HEIGHT, 0)
+        self.z_buffer = Buffer(WIDTH, HEIGHT, float("inf"), dtype=np.float32)
+        self.face_buffer = Buffer(WIDTH, HEIGHT, -1, dtype=np.int32)
+
+        self.src_normals = face_normals(self.src_verts, self.faces)
+        self.transform_stage = TransformStage()
+        self.render_tris = self.transform_stage.render_instances(
+            self.src_verts, self.faces, [identity]
+        )
+        self.face_intensities = light_instances(self.src_normals, [identity])
+        self.render_colors = np.resize(self.face_colors, len(self.faces))
+        self.render_face_ids = self.transform_stage.face_ids
         # self.render_tris = tris_from_verts(cube_verts, test_faces)
         # pyxel.mouse(True)
         pyxel.run(self.update, self.draw)
@@ -733,9 +122,31 @@ class App:
             self.ran = False
         if pyxel.btnp(pyxel.KEY_D):
             self.animate_construction = not self.animate_construction
+            self.construction_frame = self.frame_count
         if pyxel.btnp(pyxel.KEY_Z):
             self.show_z_buffer = not self.show_z_buffer
             self.ran = False
+        if pyxel.btnp(pyxel.KEY_E):
+            self.edge_rasterizer = not self.edge_rasterizer
+            self.ran = False
+        if pyxel.btnp(pyxel.KEY_C):
+            self.culling = not self.culling
+            self.ran = False
+        if pyxel.btnp(pyxel.KEY_I):
+            self.show_cull_stats = not self.show_cull_stats
+            self.ran = False
+        if pyxel.btnp(pyxel.KEY_L):
+            self.lighting = not self.lighting
+            self.ran = False
+        if pyxel.btnp(pyxel.KEY_B):
+            self.dithering = not self.dithering
+            self.ran = False
+        if pyxel.btnp(pyxel.KEY_V):
+            self.camera = None if self.camera else Camera()
+            self.ran = False
+        if pyxel.btnp(pyxel.KEY_T) and sys.platform != "emscripten":
+            self.toggle_tiles()
+            self.ran = False
         if pyxel.btnp(pyxel.KEY_S):
             self.step_through_mode = not self.step_through_mode
             self.ran = False
@@ -746,9 +157,29 @@ class App:
             self.frame_count -= 1
             self.ran = False
         if pyxel.btnp(pyxel.KEY_P):
-            self.recording_gif = True
-            self.gif_data = []
+            if self.gif_writer is not None:
+                self.gif_writer.close()
+            time_stamp = datetime.today().isoformat()
+            # encode in the background so recording doesn't drop frames,
+            # the web build can't start threads or processes
+            if sys.platform == "emscripten":
+                GifWriter = gif_exporter.GifWriter
+            else:
+                GifWriter = gif_exporter.BackgroundGifWriter
+            self.gif_writer = GifWriter(
+                "pyx_" + time_stamp + ".gif",
+                WIDTH,
+                HEIGHT,
+                FPS,
+                colors_rgb,
+                True,
+                encoding="auto",
+            ).open()
         if pyxel.btnp(pyxel.KEY_Q):
+            if self.gif_writer is not None:
+                self.gif_writer.close()
+            if self.tiler is not None:
+                self.toggle_tiles()
             pyxel.quit()
         if pyxel.btnp(pyxel.MOUSE_BUTTON_LEFT):
             x = pyxel.mouse_x
@@ -761,7 +192,7 @@ class App:
                     pass
                     # print(f"x is out of range: {x=},{y=}")
                 else:
-                    z_buff = z_buffer.get(x, y)
+                    z_buff = self.z_buffer.get(x, y)
                     # print(f"{z_buff}=")
 
         self.mouse_z += pyxel.mouse_wheel
@@ -773,16 +204,11 @@ class App:
         # self.render_tris = self.test_update(self.cube_verts,test_faces)
 
     def draw(self):
-        global pixel_buffer, z_buffer
         if self.ran is False:
             if self.step_through_mode:
                 self.ran = True
             else:
                 self.frame_count += 1
-            pyxel.cls(0)
-
-            pixel_buffer = Buffer(WIDTH, HEIGHT, 0)
-            z_buffer = Buffer(WIDTH, HEIGHT, float("inf"))
 
             anim_count = self.frame_count // 10 % len(self.render_tris) + 1
 
@@ -792,42 +218,135 @@ class App:
             else:
                 partialTris = self.render_tris
 
-            for i, tri in enumerate(partialTris[:]):
-                try:
-                    draw_tri(tri, cube_colors[i % len(cube_colors)])
-                except Exception as e:
-                    pass
-                    # print(f"couldn't draw tri: {tri=}")
-                    # print(f"an error occured: {e}")
-                    # traceback.print_exc()
-
-            if self.recording_gif:
-                self.gif_data.append(pixel_buffer.contents)
-                if len(self.gif_data) >= 100:  # FPS * 5:  # 5 second long gif
-                    self.recording_gif = False
-                    time_stamp = datetime.today().isoformat()
-                    gif_exporter.export_image(
-                        "pyx_" + time_stamp + ".gif",
-                        self.gif_data,
-                        WIDTH,
-                        HEIGHT,
-                        FPS,
-                        colors_rgb,
-                        True,
-                    )
-
-            # draw what is currently in the buffer to the screen
-            pixel_buffer.draw()
+            # additive if everything drawn last frame is still there, the
+            # same way. overlays and dithering change pixels outside the new
+            # triangles, so they always redraw
+            settings = (
+                self.edge_rasterizer,
+                self.culling,
+                self.lighting,
+                self.dithering,
+                self.show_z_buffer,
+                self.show_cull_stats,
+                self.tiler is not None,
+            )
+            num_drawn = 0 if self.drawn_tris is None else len(self.drawn_tris)
+            # a spinning model changes every triangle, only building it up or
+            # stepping through frames can leave the last frame's ones alone
+            may_add = self.animate_construction or self.step_through_mode
+            additive = (
+                may_add
+                and self.drawn_tris is not None
+                and settings == self.drawn_settings
+                and not (self.lighting and self.dithering)
+                and not self.show_z_buffer
+                and not (self.show_cull_stats and self.culling)
+                and len(partialTris) >= num_drawn
+                and np.array_equal(partialTris[:num_drawn], self.drawn_tris)
+            )
+            self.drawn_tris = partialTris.copy() if may_add else None
+            self.drawn_settings = settings
+
+            if additive:
+                first = num_drawn
+            else:
+                first = 0
+                pyxel.cls(0)
+                self.pixel_buffer.fill()
+                self.z_buffer.fill()
+
+            intensities = self.face_intensities
+            base_colors = self.render_colors
+            if self.lighting:
+                colors = shade_colors(base_colors, intensities)
+            else:
+                colors = base_colors
+
+            # clipping to the camera can split faces, so look them up
+            face_ids = self.render_face_ids[first : len(partialTris)]
+            partialTris = partialTris[first:]
+            if self.culling:
+                partialTris, kept, self.cull_stats = cull_tris(
+                    partialTris, WIDTH, HEIGHT
+                )
+                face_ids = face_ids[kept]
+            if additive:
+                rect = dirty_rect(partialTris, self.pixel_buffer)
+            else:
+                rect = None
+
+            rasterize = draw_tri_edge if self.edge_rasterizer else draw_tri
+
+            if self.lighting and self.dithering:
+                # draw which face is where, then pick each pixel's shade
+                self.face_buffer.fill()
+                draw_tris(
+                    partialTris, face_ids, self.face_buffer, self.z_buffer, rasterize
+                )
+                dither_shades(
+                    self.face_buffer, base_colors, intensities, self.pixel_buffer
+                )
+            elif self.tiler is not None:
+                self.tiler.draw_tris(partialTris, colors[face_ids], rasterize)
+            else:
+                # keep each face's color from before culling
+                draw_tris(
+                    partialTris,
+                    colors[face_ids],
+                    self.pixel_buffer,
+                    self.z_buffer,
+                    rasterize,
+                )
+
+            if self.gif_writer is not None:
+                self.gif_writer.add_frame(self.pixel_buffer.contents, rect)
+                if self.gif_writer.frame_count >= 100:  # FPS * 5:  # 5 second long gif
+                    self.gif_writer.close(wait=False)
+                    self.gif_writer = None
+
+            # draw what is currently in the buffer to the screen, the rest of
+            # the screen still has last frame's pixels
+            self.pixel_buffer.draw(rect=rect)
             if self.show_z_buffer:
-                # print(set(z_buffer.contents))
-                z_buffer.draw()
+                # print(np.unique(self.z_buffer.contents))
+                self.z_buffer.draw(normalize_depth=self.camera is not None)
+
+            if self.show_cull_stats and self.culling:
+                stats = self.cull_stats
+                pyxel.text(
+                    0,
+                    HEIGHT - 6,
+                    f"{stats.drawn}/{stats.total} back {stats.backfacing}"
+                    f" off {stats.offscreen} clip {stats.clipped}",
+                    pyxel.COLOR_WHITE,
+                )
 
             if self.animate_construction and anim_count == len(self.render_tris):
                 pyxel.text(0, 0, "Done drawing, press r to redraw", pyxel.COLOR_WHITE)
                 self.ran = True
 
+    def toggle_tiles(self):
+        if self.tiler is None:
+            # shared memory isn't available on the web, so only import it here
+            import tiled
+
+            self.tiler = tiled.TiledRasterizer(WIDTH, HEIGHT)
+            self.pixel_buffer = self.tiler.pixel_buffer
+            self.z_buffer = self.tiler.z_buffer
+        else:
+            self.pixel_buffer = Buffer(WIDTH, HEIGHT, 0)
+            self.z_buffer = Buffer(WIDTH, HEIGHT, float("inf"), dtype=np.float32)
+            self.tiler.close()
+            self.tiler = None
+
     def test_update(self, verts, faces):
         total_scale = 40.0
+        if self.scene is None:
+            self.scene = self.pair_scene(verts, faces)
+            # the pivots never move, so their world transforms stay cached
+            right, left = self.scene.root.children
+            right.set_transform(createTranslation(total_scale, 0, -200))
+            left.set_transform(createTranslation(-total_scale, 0, -200))
         # matrix multiplaction order is left to right
         common_tranform = (
             createRotationZ((pyxel.mouse_y / HEIGHT) * 2 * np.pi)
@@ -837,37 +356,45 @@ class App:
             @ createTranslation(-0.5, -0.5, -0.5)
         )
 
-        right_transform = createTranslation(total_scale, 0, -200) @ common_tranform
-
-        # left_cube= transform_verts(left_cube,createRotationZ(m.pi/50*self.frame_count+10))
-        left_transform = createTranslation(-total_scale, 0, -200) @ common_tranform
-
-        right_cube = copy.deepcopy(verts)
-        left_cube = copy.deepcopy(verts)
-
-        # apply all transforms
-        right_cube = transform_verts(right_cube, right_transform)
-        left_cube = transform_verts(left_cube, left_transform)
-
-        render_right = tris_from_verts(right_cube, faces)
-        render_left = tris_from_verts(left_cube, faces)
-        return render_right + render_left
+        for pivot in self.scene.root.children:
+            pivot.children[0].set_transform(common_tranform)
+        return self.render_scene()
 
     def model_rotate(self, verts, faces):
-        total_scale = 80.0
-        # matrix multiplaction order is left to right
-        transform = createRotationY(m.pi / 50 * self.frame_count + 10) @ createScale(
-            total_scale, total_scale, total_scale
+        # held still while it is built up, so each step only adds a triangle
+        # and the rest of the screen can be left alone
+        if self.animate_construction:
+            transform = turntable_transform(self.construction_frame)
+        else:
+            transform = turntable_transform(self.frame_count)
+
+        self.face_intensities = light_instances(self.src_normals, [transform])
+        self.render_colors = np.resize(self.face_colors, len(faces))
+        render_tris = self.transform_stage.render_instances(
+            verts, faces, [transform], self.camera
         )
-
-        render_verts = copy.deepcopy(verts)
-
-        render_verts = transform_verts(render_verts, transform)
-        render_tris = tris_from_verts(render_verts, faces)
+        self.render_face_ids = self.transform_stage.face_ids
         return render_tris
 
+    def pair_scene(self, verts, faces):
+        """a scene with two copies of the mesh, each one under a pivot"""
+        shape = Shape(verts, faces, self.face_colors)
+        scene = Scene()
+        for _ in range(2):
+            scene.root.add(Node()).add(Node(shape))
+        return scene
+
+    def render_scene(self):
+        frame = self.scene.render(self.camera)
+        self.face_intensities = frame.intensities
+        self.render_colors = frame.colors
+        self.render_face_ids = frame.face_ids
+        return frame.tris
+
     def cube_update(self, verts, faces):
         total_scale = 40.0
+        if self.scene is None:
+            self.scene = self.pair_scene(verts, faces)
         # matrix multiplaction order is left to right
         common_tranform = (
             createRotationY(m.pi / 50 * self.frame_count + 10)
@@ -876,29 +403,19 @@ class App:
             @ createTranslation(-0.5, -0.5, -0.5)
         )
 
-        right_transform = (
+        right, left = self.scene.root.children
+        right.set_transform(
             createTranslation(total_scale, 0, -200)
             @ createRotationZ(m.pi / 50 * self.frame_count + 10)
-            @ common_tranform
         )
-
-        # left_cube= transform_verts(left_cube,createRotationZ(m.pi/50*self.frame_count+10))
-        left_transform = (
+        left.set_transform(
             createTranslation(-total_scale, 0, -200)
             @ createRotationZ(-m.pi / 50 * self.frame_count + 10)
-            @ common_tranform
         )
-
-        right_cube = copy.deepcopy(verts)
-        left_cube = copy.deepcopy(verts)
-
-        # apply all transforms
-        right_cube = transform_verts(right_cube, right_transform)
-        left_cube = transform_verts(left_cube, left_transform)
-
-        render_right = tris_from_verts(right_cube, faces)
-        render_left = tris_from_verts(left_cube, faces)
-        return render_right + render_left
+        for pivot in (right, left):
+            pivot.children[0].set_transform(common_tranform)
+        return self.render_scene()
 
 
-App()
+if __name__ == "__main__":
+    App()
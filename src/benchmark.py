@@ -0,0 +1,585 @@
+"""Benchmarks, run from the root of the repo
+
+python src/benchmark.py render --save baseline.json
+python src/benchmark.py render --compare baseline.json
+python src/benchmark.py export --workers 1 2 4
+python src/benchmark.py gif-size examples/*.gif
+python src/benchmark.py parse --triangles 1000000
+python src/benchmark.py tiles --size 640 480 --workers 1 2 4
+python src/benchmark.py instances --count 1000
+"""
+
+import argparse
+import dataclasses
+import json
+import math as m
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable
+
+import numpy as np
+import numpy.typing as npt
+import pyxel
+from PIL import Image, ImageSequence
+
+import gif_exporter
+import obj_parser as obj
+import tiled
+from renderer import (
+    WIDTH,
+    HEIGHT,
+    Buffer,
+    FaceArray,
+    Mat4,
+    TransformStage,
+    VertArray,
+    colors_rgb,
+    create_down_tris,
+    create_standard_tris,
+    create_up_tris,
+    createTranslation,
+    cube_colors,
+    cube_faces,
+    cube_verts,
+    cull_tris,
+    draw_tri,
+    draw_tri_edge,
+    draw_tris,
+    face_normals,
+    identity,
+    lambert,
+    light_instances,
+    niave_cube_faces,
+    niave_cube_verts,
+    nearest_palette_colors,
+    transform_normals,
+    transform_verts,
+    tris_from_verts,
+    turntable_transform,
+)
+
+# 100 frames of the spinning porygon, recorded from the app
+porygon_recording = "./examples/porygon-no-diff-compression.gif"
+porygon_model = "./assets/porygon/model.obj"
+
+rasterizers = {"edge": draw_tri_edge, "scanline": draw_tri}
+
+# how much slower a stage can get before --compare calls it a regression
+default_tolerance = 0.2
+# stage timings closer than this to the baseline are just noise
+noise_floor_ms = 0.1
+
+
+@dataclasses.dataclass
+class Scene:
+    verts: VertArray
+    faces: FaceArray
+    # transform for each frame number
+    transform: Callable[[int], Mat4]
+    # only for meshes with consistent winding
+    cull_backfaces: bool = False
+    # palette color of each face, or cycled through
+    colors: npt.ArrayLike = dataclasses.field(default_factory=lambda: cube_colors)
+
+
+def random_tris_scene(create_tris, num_tris: int) -> Scene:
+    """a scene of screen space triangles from one of the create_*_tris
+    generators, which only make x and y, so z is 0"""
+    tris = np.array(create_tris(num_tris), dtype=float)
+    verts = np.zeros((num_tris * 3, 4))
+    verts[:, :2] = tris.reshape(-1, 2)
+    verts[:, 3] = 1.0
+    faces = np.arange(num_tris * 3, dtype=np.intp).reshape(-1, 3)
+    return Scene(verts, faces, lambda frame_count: identity)
+
+
+def create_scenes(seed: int, num_random_tris: int) -> dict[str, Scene]:
+    random.seed(seed)
+    porygon = obj.load_mesh(porygon_model)
+    porygon_colors = nearest_palette_colors(obj.material_colors(porygon_model, porygon))
+    centered_cube = createTranslation(-0.5, -0.5, -0.5)
+    return {
+        "cube": Scene(
+            cube_verts,
+            cube_faces,
+            lambda frame_count: turntable_transform(frame_count, 40.0) @ centered_cube,
+        ),
+        "niave_cube": Scene(
+            niave_cube_verts, niave_cube_faces, lambda frame_count: identity
+        ),
+        "porygon": Scene(
+            porygon.positions,
+            porygon.faces,
+            turntable_transform,
+            True,
+            porygon_colors[porygon.material_ids],
+        ),
+        "standard_tris": random_tris_scene(create_standard_tris, num_random_tris),
+        "up_tris": random_tris_scene(create_up_tris, num_random_tris),
+        "down_tris": random_tris_scene(create_down_tris, num_random_tris),
+    }
+
+
+def render_scene(scene: Scene, num_frames: int, rasterize) -> dict[str, float]:
+    """render the scene headlessly, timing each stage of the pipeline"""
+    pixel_buffer = Buffer(WIDTH, HEIGHT, 0)
+    z_buffer = Buffer(WIDTH, HEIGHT, float("inf"), dtype=np.float32)
+    transform_stage = TransformStage()
+    screen = pyxel.Image(WIDTH, HEIGHT)
+
+    seconds = {
+        "transform": 0.0,
+        "cull": 0.0,
+        "rasterize": 0.0,
+        "draw": 0.0,
+        "export": 0.0,
+    }
+    num_pixels = 0
+    frames = []
+    for frame_count in range(1, num_frames + 1):
+        start = time.perf_counter()
+        render_tris = transform_stage.render_instances(
+            scene.verts, scene.faces, [scene.transform(frame_count)]
+        )
+        transformed = time.perf_counter()
+
+        render_tris, face_ids, _ = cull_tris(
+            render_tris, WIDTH, HEIGHT, cull_backfaces=scene.cull_backfaces
+        )
+        colors = np.take(scene.colors, face_ids, mode="wrap")
+        culled = time.perf_counter()
+
+        pixel_buffer.fill()
+        z_buffer.fill()
+        draw_tris(render_tris, colors, pixel_buffer, z_buffer, rasterize)
+        rasterized = time.perf_counter()
+
+        pixel_buffer.draw(screen)
+        drawn = time.perf_counter()
+
+        seconds["transform"] += transformed - start
+        seconds["cull"] += culled - transformed
+        seconds["rasterize"] += rasterized - culled
+        seconds["draw"] += drawn - rasterized
+        num_pixels += int(np.isfinite(z_buffer.contents).sum())
+        frames.append(pixel_buffer.contents.copy())
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        start = time.perf_counter()
+        gif_exporter.export_image(
+            os.path.join(tmp_dir, "benchmark.gif"),
+            frames,
+            WIDTH,
+            HEIGHT,
+            15,
+            list(colors_rgb),
+        )
+        seconds["export"] = time.perf_counter() - start
+
+    results = {f"{stage}_ms": 1000 * s / num_frames for stage, s in seconds.items()}
+    results["tris_per_s"] = len(scene.faces) * num_frames / seconds["rasterize"]
+    results["pixels_per_s"] = num_pixels / seconds["rasterize"]
+    return results
+
+
+def bench_render(scenes: dict[str, Scene], num_frames: int, rasterize):
+    results = {}
+    for name, scene in scenes.items():
+        results[name] = render_scene(scene, num_frames, rasterize)
+
+        # tracing allocations slows everything down, so measure memory
+        # in a separate run
+        tracemalloc.start()
+        render_scene(scene, 1, rasterize)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        results[name]["peak_kib"] = peak / 1024
+    return results
+
+
+def print_render_results(results):
+    columns = list(next(iter(results.values())))
+    print(f"{'scene':14s}" + "".join(f"{c:>15s}" for c in columns))
+    for name, metrics in results.items():
+        print(f"{name:14s}" + "".join(f"{metrics[c]:15.2f}" for c in columns))
+
+
+def find_regressions(results, baseline, tolerance) -> list[str]:
+    """metrics that got worse than the baseline by more than tolerance"""
+    regressions = []
+    for name, metrics in results.items():
+        for metric, value in metrics.items():
+            old = baseline.get(name, {}).get(metric)
+            if old is None or old == 0:
+                continue
+            if metric.endswith("_ms") and abs(value - old) < noise_floor_ms:
+                continue
+            # throughput should go up, everything else should go down
+            if metric.endswith("_per_s"):
+                change = old / value - 1 if value else float("inf")
+            else:
+                change = value / old - 1
+            if change > tolerance:
+                regressions.append(
+                    f"{name} {metric}: {old:.2f} -> {value:.2f} ({change:+.0%} worse)"
+                )
+    return regressions
+
+
+def load_gif_frames(file_name):
+    """decode a gif into 2d arrays of color indices and its palette"""
+    with Image.open(file_name) as im:
+        palette = np.array(im.getpalette(), dtype=np.uint8).reshape(-1, 3)
+        # look colors back up by their packed rgb value
+        packed_palette = palette.astype(np.uint32) @ [1 << 16, 1 << 8, 1]
+        lookup = {int(rgb): i for i, rgb in reversed(list(enumerate(packed_palette)))}
+
+        frames = []
+        for frame in ImageSequence.Iterator(im):
+            rgb = np.array(frame.convert("RGB"), dtype=np.uint32)
+            packed = rgb @ [1 << 16, 1 << 8, 1]
+            indices = np.vectorize(lookup.__getitem__, otypes=[np.uint8])(packed)
+            frames.append(indices)
+
+    colors = [tuple(int(c) for c in rgb) for rgb in palette[:16]]
+    return frames, colors
+
+
+def bench_export(frames, colors, workers_counts):
+    """seconds to export frames with each number of workers"""
+    height, width = frames[0].shape
+    timings = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for workers in workers_counts:
+            file_name = os.path.join(tmp_dir, f"export_{workers}.gif")
+            start = time.perf_counter()
+            gif_exporter.export_image(
+                file_name, frames, width, height, 15, list(colors), workers=workers
+            )
+            timings[workers] = time.perf_counter() - start
+    return timings
+
+
+def bench_gif_size(file_names):
+    """bytes of each gif re-exported with every frame encoding, opaque and
+    with a transparent background"""
+    sizes = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for file_name in file_names:
+            frames, colors = load_gif_frames(file_name)
+            height, width = frames[0].shape
+            for useTransparency in [False, True]:
+                key = (file_name, "transparent" if useTransparency else "opaque")
+                sizes[key] = {}
+                for encoding in gif_exporter.frame_encodings:
+                    out_name = os.path.join(tmp_dir, f"{encoding}.gif")
+                    gif_exporter.export_image(
+                        out_name,
+                        frames,
+                        width,
+                        height,
+                        15,
+                        list(colors),
+                        useTransparency,
+                        encoding=encoding,
+                    )
+                    sizes[key][encoding] = os.path.getsize(out_name)
+    return sizes
+
+
+def write_grid_obj(file_name, num_triangles: int):
+    """a square grid of about num_triangles triangles with uvs, normals and
+    a few materials, written the way modelling tools write obj files"""
+    side = max(1, round(m.sqrt(num_triangles / 2)))
+    n = side + 1
+    y, x = np.mgrid[0:n, 0:n]
+    xs = (x / side).ravel()
+    ys = (y / side).ravel()
+
+    # each quad is split into two triangles, indices start at 1
+    corner = (y[:-1, :-1] * n + x[:-1, :-1]).ravel() + 1
+    tris = np.stack(
+        [
+            np.stack([corner, corner + 1, corner + n + 1], axis=1),
+            np.stack([corner, corner + n + 1, corner + n], axis=1),
+        ],
+        axis=1,
+    ).reshape(-1, 3)
+    materials_per_mesh = 4
+
+    with open(file_name, "w") as f:
+        f.write("mtllib materials.mtl\no grid\n")
+        f.write("".join(f"v {x:.6f} {y:.6f} 0.0\n" for x, y in zip(xs, ys)))
+        f.write("".join(f"vt {x:.6f} {y:.6f}\n" for x, y in zip(xs, ys)))
+        f.write("vn 0.0 0.0 1.0\n")
+        for i, chunk in enumerate(np.array_split(tris, materials_per_mesh)):
+            f.write(f"usemtl mat{i}\n")
+            f.write(
+                "".join(
+                    f"f {a}/{a}/1 {b}/{b}/1 {c}/{c}/1\n" for a, b, c in chunk.tolist()
+                )
+            )
+    return len(tris)
+
+
+def bench_parse(num_triangles: int):
+    """seconds to parse a large obj, and to load it again from the cache"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file_name = os.path.join(tmp_dir, "grid.obj")
+        num_triangles = write_grid_obj(file_name, num_triangles)
+        size = os.path.getsize(file_name)
+
+        start = time.perf_counter()
+        obj.load_mesh(file_name, use_cache=False)
+        parsed = time.perf_counter()
+        obj.load_mesh(file_name)
+        cached = time.perf_counter()
+        mesh = obj.load_mesh(file_name)
+        loaded = time.perf_counter()
+        # memory mapped arrays are only read from disk when they are used
+        mesh.faces.sum()
+        touched = time.perf_counter()
+        del mesh
+
+    return {
+        "triangles": num_triangles,
+        "MiB": size / 2**20,
+        "parse_s": parsed - start,
+        "parse_and_cache_s": cached - parsed,
+        "cached_load_s": loaded - cached,
+        "cached_read_faces_s": touched - loaded,
+    }
+
+
+def bench_tiles(
+    width, height, num_tris, num_frames, workers_counts, tile_size, rasterize
+):
+    """seconds per frame to rasterize random triangles spread over
+    width x height, serially and tiled with each number of workers"""
+    tris = np.array(create_standard_tris(num_tris, width, height), dtype=float)
+    depths = np.random.default_rng(0).uniform(-50, 50, (num_tris, 3, 1))
+    tris = np.concatenate([tris, depths], axis=2)
+
+    pixel_buffer = Buffer(width, height, 0)
+    z_buffer = Buffer(width, height, float("inf"), dtype=np.float32)
+    start = time.perf_counter()
+    for _ in range(num_frames):
+        pixel_buffer.fill()
+        z_buffer.fill()
+        draw_tris(tris, cube_colors, pixel_buffer, z_buffer, rasterize)
+    timings = {"serial": (time.perf_counter() - start) / num_frames}
+
+    for workers in workers_counts:
+        with tiled.TiledRasterizer(width, height, tile_size, workers) as tiler:
+            # the first frame starts the workers
+            tiler.draw_tris(tris, cube_colors, rasterize)
+            start = time.perf_counter()
+            for _ in range(num_frames):
+                tiler.pixel_buffer.fill()
+                tiler.z_buffer.fill()
+                tiler.draw_tris(tris, cube_colors, rasterize)
+            timings[f"{workers} workers"] = (time.perf_counter() - start) / num_frames
+            if not np.array_equal(tiler.pixel_buffer.contents, pixel_buffer.contents):
+                raise AssertionError(f"tiled output with {workers} workers differs")
+    return timings
+
+
+def bench_instances(num_instances: int, num_frames: int):
+    """milliseconds per frame to transform and light a grid of spinning
+    cubes, an instance at a time and all in one batch, and to cull and
+    rasterize the result"""
+    columns = m.ceil(m.sqrt(num_instances * WIDTH / HEIGHT))
+    rows = m.ceil(num_instances / columns)
+    spacing = min(WIDTH / columns, HEIGHT / rows)
+    grid = np.stack(
+        [
+            createTranslation(
+                (i % columns - (columns - 1) / 2) * spacing,
+                (i // columns - (rows - 1) / 2) * spacing,
+                0,
+            )
+            for i in range(num_instances)
+        ]
+    )
+    centered_cube = createTranslation(-0.5, -0.5, -0.5)
+    normals = face_normals(cube_verts, cube_faces)
+    num_verts = len(cube_verts)
+    num_tris = len(cube_faces)
+    looped_verts = np.empty((num_verts * num_instances, 4))
+    looped_tris = np.empty((num_tris * num_instances, 3, 3))
+    transform_stage = TransformStage()
+    pixel_buffer = Buffer(WIDTH, HEIGHT, 0)
+    z_buffer = Buffer(WIDTH, HEIGHT, float("inf"), dtype=np.float32)
+
+    seconds = dict.fromkeys(["loop", "batched", "cull", "rasterize"], 0.0)
+    for frame_count in range(1, num_frames + 1):
+        spin = turntable_transform(frame_count, spacing / 2) @ centered_cube
+        transforms = grid @ spin
+
+        start = time.perf_counter()
+        for i, transform in enumerate(transforms):
+            instance_verts = looped_verts[i * num_verts : (i + 1) * num_verts]
+            transform_verts(cube_verts, transform, out=instance_verts)
+            tris_from_verts(
+                instance_verts,
+                cube_faces,
+                out=looped_tris[i * num_tris : (i + 1) * num_tris],
+            )
+        np.concatenate(
+            [lambert(transform_normals(normals, transform)) for transform in transforms]
+        )
+        looped = time.perf_counter()
+
+        render_tris = transform_stage.render_instances(
+            cube_verts, cube_faces, transforms
+        )
+        light_instances(normals, transforms)
+        batched = time.perf_counter()
+        if not np.allclose(render_tris, looped_tris):
+            raise AssertionError("batched instances differ from the loop")
+
+        tris, face_ids, _ = cull_tris(render_tris, WIDTH, HEIGHT)
+        culled = time.perf_counter()
+        pixel_buffer.fill()
+        z_buffer.fill()
+        draw_tris(tris, cube_colors, pixel_buffer, z_buffer)
+        rasterized = time.perf_counter()
+
+        seconds["loop"] += looped - start
+        seconds["batched"] += batched - looped
+        seconds["cull"] += culled - batched
+        seconds["rasterize"] += rasterized - culled
+    return {stage: 1000 * s / num_frames for stage, s in seconds.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    render_parser = subparsers.add_parser(
+        "render", help="per stage timings of fixed scenes"
+    )
+    render_parser.add_argument("--frames", type=int, default=20)
+    render_parser.add_argument("--seed", type=int, default=0)
+    render_parser.add_argument("--random-tris", type=int, default=50)
+    render_parser.add_argument("--rasterizer", choices=rasterizers, default="edge")
+    render_parser.add_argument("--save", help="write the results to a json file")
+    render_parser.add_argument(
+        "--compare", help="fail if results are worse than this saved json"
+    )
+    render_parser.add_argument("--tolerance", type=float, default=default_tolerance)
+
+    export_parser = subparsers.add_parser(
+        "export", help="gif export of the porygon recording"
+    )
+    export_parser.add_argument(
+        "--workers", type=int, nargs="+", default=[1, 2, 4, os.cpu_count() or 1]
+    )
+    export_parser.add_argument("--gif", default=porygon_recording)
+
+    gif_size_parser = subparsers.add_parser(
+        "gif-size", help="size of gifs re-exported with each frame encoding"
+    )
+    gif_size_parser.add_argument("gifs", nargs="*", default=[porygon_recording])
+
+    parse_parser = subparsers.add_parser(
+        "parse", help="obj parsing and mesh cache of a large synthetic grid"
+    )
+    parse_parser.add_argument("--triangles", type=int, default=1_000_000)
+
+    tiles_parser = subparsers.add_parser(
+        "tiles", help="tiled rasterizing of random triangles at a higher resolution"
+    )
+    tiles_parser.add_argument("--size", type=int, nargs=2, default=[640, 480])
+    tiles_parser.add_argument("--tris", type=int, default=200)
+    tiles_parser.add_argument("--frames", type=int, default=5)
+    tiles_parser.add_argument("--tile-size", type=int, default=64)
+    tiles_parser.add_argument(
+        "--workers", type=int, nargs="+", default=[1, 2, 4, os.cpu_count() or 1]
+    )
+    tiles_parser.add_argument("--seed", type=int, default=0)
+    tiles_parser.add_argument("--rasterizer", choices=rasterizers, default="edge")
+
+    instances_parser = subparsers.add_parser(
+        "instances", help="transforming many instances of a cube at once"
+    )
+    instances_parser.add_argument("--count", type=int, default=1000)
+    instances_parser.add_argument("--frames", type=int, default=10)
+
+    args = parser.parse_args()
+
+    if args.benchmark == "render":
+        scenes = create_scenes(args.seed, args.random_tris)
+        results = bench_render(scenes, args.frames, rasterizers[args.rasterizer])
+        print_render_results(results)
+
+        if args.save:
+            with open(args.save, "w") as f:
+                json.dump(results, f, indent=2)
+
+        if args.compare:
+            with open(args.compare) as f:
+                baseline = json.load(f)
+            regressions = find_regressions(results, baseline, args.tolerance)
+            for regression in regressions:
+                print("regression:", regression)
+            if regressions:
+                sys.exit(1)
+
+    if args.benchmark == "export":
+        frames, colors = load_gif_frames(args.gif)
+        timings = bench_export(frames, colors, sorted(set(args.workers)))
+        serial = timings[min(timings)]
+        print(f"exporting {len(frames)} frames on {os.cpu_count()} cores")
+        for workers, seconds in timings.items():
+            print(f"{workers:3d} workers {seconds:8.3f}s {serial / seconds:6.2f}x")
+
+    if args.benchmark == "gif-size":
+        sizes = bench_gif_size(args.gifs)
+        encodings = gif_exporter.frame_encodings
+        print(f"{'gif':44s}{'':12s}" + "".join(f"{e:>9s}" for e in encodings))
+        for (file_name, mode), by_encoding in sizes.items():
+            saved = [1 - by_encoding["auto"] / by_encoding[e] for e in ["full", "box"]]
+            print(
+                f"{os.path.basename(file_name):44s}{mode:12s}"
+                + "".join(f"{by_encoding[e]:9d}" for e in encodings)
+                + f"  auto saves {saved[0]:.1%} over full, {saved[1]:.1%} over box"
+            )
+
+    if args.benchmark == "instances":
+        timings = bench_instances(args.count, args.frames)
+        print(f"{args.count} cubes, {args.count * len(cube_faces)} triangles")
+        for name, ms in timings.items():
+            print(f"{name:>10s} {ms:8.2f}ms")
+        print(f"batching is {timings['loop'] / timings['batched']:.1f}x faster")
+
+    if args.benchmark == "tiles":
+        random.seed(args.seed)
+        width, height = args.size
+        timings = bench_tiles(
+            width,
+            height,
+            args.tris,
+            args.frames,
+            sorted(set(args.workers)),
+            args.tile_size,
+            rasterizers[args.rasterizer],
+        )
+        serial = timings["serial"]
+        print(f"{args.tris} triangles at {width}x{height}, {os.cpu_count()} cores")
+        for name, seconds in timings.items():
+            print(f"{name:>10s} {1000 * seconds:8.1f}ms {serial / seconds:6.2f}x")
+
+    if args.benchmark == "parse":
+        for name, value in bench_parse(args.triangles).items():
+            print(f"{name:22s}{value:12.3f}")
+
+
+if __name__ == "__main__":
+    main()
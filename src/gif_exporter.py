@@ -1,7 +1,14 @@
 # following https://giflib.sourceforge.net/whatsinagif/bits_and_bytes.html
+import itertools
 import math as m
+import queue
+import threading
+import traceback
+from collections import deque
 import numpy as np
 
+from worker_pool import spawn_pool
+
 # header = b'\x47\x49\x46\x38\x39\x61'
 #            G,     I,   F,    8,     9,   a, # 89a is the version alternatives are 87a
 from collections.abc import Iterable
@@ -78,22 +85,24 @@ def application_control_extension():
     )
 
 
-def graphic_control_extension(delay, useTransparency):
-    """delay in hundreths of seconds"""
+def graphic_control_extension(delay, transparent_index=None, clear=False):
+    """delay in hundreths of seconds. pixels of transparent_index, if given,
+    show whatever was there before. clear wipes the frame's area away
+    before the next frame, otherwise it stays"""
     extension_introducer = b"\x21"  # always 0x21
     graphic_control_label = b"\xf9"  # always 0xF9
     block_size = int.to_bytes(4, 1, "little")
     # packed_field = b"\x01"  # many flags in here, last bit is transparency
     CLEAR_SCREEN = "010"
     KEEP_SCREEN = "001"
-    disposal_method = CLEAR_SCREEN if useTransparency else KEEP_SCREEN
-    transparency_flag = "1" if useTransparency else "0"
+    disposal_method = CLEAR_SCREEN if clear else KEEP_SCREEN
+    transparency_flag = "0" if transparent_index is None else "1"
     user_input_flag = "0"  # rarely used and might not be widely supported
     packed_field_string = "000" + disposal_method + user_input_flag + transparency_flag
     packed_field = int(packed_field_string, 2).to_bytes(1, "little")
 
     delay_time = int.to_bytes(delay, 2, "little")
-    transparent_color_index = int.to_bytes(0, 1, "little")
+    transparent_color_index = int.to_bytes(transparent_index or 0, 1, "little")
     block_terminator = b"\x00"  # always 0
 
     return (
@@ -145,18 +154,23 @@ def print_codes(codes):
 # CodeStream = list[Code]
 
 
+# gif codes are at most 12 bits, so the code table can hold 4096 codes
+max_code_table_size = 2**12
+
+
 # index stream to code stream
 def data_to_codes(indexStream, num_color_bits: int) -> tuple[list[int], list[int]]:
     clear_code = 2**num_color_bits
     end_info_code = clear_code + 1
+    initial_table_len = clear_code + 2
 
     # Has Sequences of colors, and special control codes
-    # Code table is a list of tuples
-    initial_code_table = [(i,) for i in range(0, 2**num_color_bits)]
-    initial_code_table += [(clear_code,), (end_info_code,)]
-
-    # Dynamically create the code table, decoding will be able to build the same table
-    code_table = initial_code_table.copy()
+    # The code table is stored as a trie: each sequence is a code for the
+    # sequence without its last index (the prefix), plus that last index.
+    # (prefix_code, index) -> code of the sequence
+    # single indices are their own code and are not stored
+    code_table: dict[tuple[int, int], int] = {}
+    table_len = initial_table_len
 
     # Codes are indices into code_table
     # this is our output data
@@ -166,82 +180,93 @@ def data_to_codes(indexStream, num_color_bits: int) -> tuple[list[int], list[int
     # Code_table_len_stream will track the size of the code table
     # when each code is added
     code_stream += [clear_code]
-    code_table_len_stream += [len(code_table)]
-
-    # Keep track of the range of indices until we know what their code is
-    index_buffer = []
-    old_table_len = len(code_table)
-
-    for i, k in enumerate(indexStream):
-        if i == 0:
-            index_buffer += [k]
-        else:
-            if tuple(index_buffer + [k]) in code_table:
-                index_buffer += [k]
-            else:
-                code_table_len_stream += [old_table_len]
-                old_table_len = len(code_table)
-
-                code_table.append(tuple(index_buffer + [k]))
-                code = code_table.index(tuple(index_buffer))
-                code_stream += [code]
-                index_buffer = [k]
+    code_table_len_stream += [table_len]
+
+    # Code of the range of indices we are still extending until we know
+    # what their code is
+    prefix_code = None
+    old_table_len = table_len
+
+    for k in np.asarray(indexStream).ravel().tolist():
+        if prefix_code is None:
+            prefix_code = k
+            continue
+
+        code = code_table.get((prefix_code, k))
+        if code is not None:
+            prefix_code = code
+            continue
+
+        code_stream += [prefix_code]
+        code_table_len_stream += [old_table_len]
+        old_table_len = table_len
+
+        code_table[(prefix_code, k)] = table_len
+        table_len += 1
+        prefix_code = k
+
+        if table_len == max_code_table_size:
+            # the table is full, tell the decoder to start a new one
+            code_stream += [clear_code]
+            code_table_len_stream += [old_table_len]
+            code_table.clear()
+            table_len = initial_table_len
+            old_table_len = table_len
 
     # handle what remains in index buffer
-    code = code_table.index(tuple(index_buffer))
-    code_stream += [code]
-    code_table_len_stream += [len(code_table)]
+    code_stream += [prefix_code]
+    code_table_len_stream += [table_len]
     code_stream += [end_info_code]
-    code_table_len_stream += [len(code_table)]
+    code_table_len_stream += [table_len]
 
     return code_stream, code_table_len_stream
 
 
-def image_data(data, num_color_bits):
-    lzw_min_code_size = int.to_bytes(num_color_bits, 1, "little")
-
-    codes, code_table_sizes = data_to_codes(data, num_color_bits)
+def pack_codes(codes: list[int], code_table_sizes: list[int]) -> bytearray:
+    """pack each code into as many bits as its code table size needs,
+    least significant bit first, the way the gif decoder reads them"""
+    num_bits = sum(size.bit_length() for size in code_table_sizes)
+    packed = bytearray(m.ceil(num_bits / 8))
 
-    encoded_data = ""
+    # bits that have not filled a whole byte yet
+    bit_buffer = 0
+    num_buffered_bits = 0
+    byte_index = 0
     for code, code_table_size in zip(codes, code_table_sizes):
-        num_code_bits = m.floor(m.log2(code_table_size) + 1)
-        encoded_data = f"{code:0{num_code_bits}b}" + encoded_data
-    num_bits = len(encoded_data)
-    num_bits_to_add = 8 - (num_bits % 8)
+        bit_buffer |= code << num_buffered_bits
+        num_buffered_bits += code_table_size.bit_length()
+        while num_buffered_bits >= 8:
+            packed[byte_index] = bit_buffer & 0xFF
+            bit_buffer >>= 8
+            num_buffered_bits -= 8
+            byte_index += 1
+
+    if num_buffered_bits > 0:
+        packed[byte_index] = bit_buffer
 
-    encoded_data = ("0" * num_bits_to_add) + encoded_data
+    return packed
+
+
+def image_data(data, num_color_bits):
+    lzw_min_code_size = int.to_bytes(num_color_bits, 1, "little")
 
-    num_bytes = len(encoded_data) // 8
+    codes, code_table_sizes = data_to_codes(data, num_color_bits)
+    encoded_data = memoryview(pack_codes(codes, code_table_sizes))
 
     # gif image data sub-blocks can not be larger
     # than 255 bytes
     sub_block_max = 255
-    num_sub_blocks = m.ceil(num_bytes / sub_block_max)
-
-    output_bytes = lzw_min_code_size
-    for i in range(num_sub_blocks):
-        if i < num_sub_blocks - 1:
-            sub_block_size_int = sub_block_max
-            start_index = len(encoded_data) - 8 * sub_block_max * (i + 1)
-            end_index = len(encoded_data) - 8 * sub_block_max * i
-            sub_block_data = encoded_data[start_index:end_index]
-        else:
-            start_index = 0
-            end_index = len(encoded_data) - 8 * sub_block_max * i
-            sub_block_data = encoded_data[:end_index]
-            sub_block_size_int = len(sub_block_data) // 8
-
-        sub_block_size = int.to_bytes(sub_block_size_int, 1, "little")
-        sub_block_data_as_bytes = int(sub_block_data, 2).to_bytes(
-            sub_block_size_int, "little"
-        )
 
-        output_bytes += sub_block_size + sub_block_data_as_bytes
+    output_bytes = bytearray(lzw_min_code_size)
+    for start_index in range(0, len(encoded_data), sub_block_max):
+        sub_block_data = encoded_data[start_index : start_index + sub_block_max]
+        output_bytes.append(len(sub_block_data))
+        output_bytes += sub_block_data
 
     block_terminator = b"\x00"  # always 0
     output_bytes += block_terminator
 
-    return output_bytes
+    return bytes(output_bytes)
 
 
 def comment_extension(): ...
@@ -249,6 +274,9 @@ def comment_extension(): ...
 
 def findBoundingBox(data):
     (column_nz_indices, row_nz_indices) = np.nonzero(data)
+    if len(row_nz_indices) == 0:
+        # nothing to bound, a frame needs at least one pixel though
+        return (0, 0, 1, 1)
 
     left = int(min(row_nz_indices))
     right = int(max(row_nz_indices))
@@ -274,49 +302,356 @@ def find_frame_diff(prev_frame, next_frame):
     return findBoundingBox(mask)
 
 
-def export_image(
-    file_name, frame_data, width, height, fps, colors, useTransparency=False
-):
-    """frame data is a list of frames of data. a frame is a 1d list of color indicies"""
-    # delay is measured in hundreths of seconds
-    delay_hms = m.ceil((1 / fps) * 0.01)
-    num_colors = len(colors)
-    num_color_bits = m.ceil(m.log2(num_colors))
-    file_contents = (
-        header
-        + logical_screen_descriptor(
-            width, height, num_color_bits
-        )  # TODO make this color size a reasonable input
-        + color_table(colors, num_color_bits)
-        + application_control_extension()
-    )
-
-    for i, frame in enumerate(frame_data):
-        drawDiffBox = i != 0 and not useTransparency
-        if drawDiffBox:
-            np_frame = np.reshape(frame, (height, width))
-            np_prev_frame = np.reshape(frame_data[i - 1], (height, width))
-
-            (x, y, diff_width, diff_height) = find_frame_diff(np_prev_frame, np_frame)
-
-            npDiff_frame = np_frame[y : y + diff_height, x : x + diff_width]
-
-            diff_frame = npDiff_frame.ravel()
-        else:
-            x = 0
-            y = 0
-            diff_width = width
-            diff_height = height
-            diff_frame = frame
-        file_contents += (
-            graphic_control_extension(delay_hms, useTransparency)
-            + image_descriptor(x, y, diff_width, diff_height)
-            + image_data(diff_frame, num_color_bits)  # frmt:skip
+def uncovers_background(prev_frame, next_frame):
+    """whether any pixel goes back to the background, index 0"""
+    return bool(np.any((next_frame == 0) & (prev_frame != 0)))
+
+
+def mask_unchanged(prev_region, region, num_color_bits, transparent_index=None):
+    """region with the pixels that are the same as before swapped for a
+    transparent index, so they keep the last frame's color and LZW gets long
+    runs of one index. without a transparent_index, one the changed pixels
+    don't use is picked, or None is returned if they use them all"""
+    changed = prev_region != region
+    if transparent_index is None:
+        used = np.bincount(region[changed], minlength=1 << num_color_bits)
+        unused = np.flatnonzero(used == 0)
+        if len(unused) == 0:
+            return None
+        transparent_index = int(unused[0])
+    return np.where(changed, region, transparent_index), transparent_index
+
+
+def encode_smallest(candidates, num_color_bits):
+    """encode each (x, y, width, height, data, transparent_index) way of
+    writing a frame, and return the smallest with data swapped for its
+    encoding"""
+    smallest = None
+    for x, y, width, height, data, transparent_index in candidates:
+        encoded = image_data(data, num_color_bits)
+        if smallest is None or len(encoded) < len(smallest[4]):
+            smallest = (x, y, width, height, encoded, transparent_index)
+    return smallest
+
+
+# ways each frame after the first can be written
+# full: the whole frame
+# box: the bounding box of what changed
+# masked: the box, with the pixels that didn't change made transparent
+# auto: whichever of those comes out smallest, which is the slowest to encode
+frame_encodings = ["full", "box", "masked", "auto"]
+
+
+class GifWriter:
+    """Writes a gif to disk a frame at a time, so only the last two frames
+    are kept in memory. a frame is a 1d or 2d list of color indicies
+
+    with GifWriter("out.gif", width, height, fps, colors) as gif:
+        gif.add_frame(frame)
+
+    each frame is written once the next one is added, as how it can be
+    written depends on both sides. encoding is one of frame_encodings.
+    useTransparency makes the background, index 0, transparent"""
+
+    def __init__(
+        self,
+        file_name,
+        width,
+        height,
+        fps,
+        colors,
+        useTransparency=False,
+        encoding="box",
+    ):
+        self.file_name = file_name
+        self.width = width
+        self.height = height
+        self.colors = colors
+        self.useTransparency = useTransparency
+        self.encoding = encoding
+        # delay is measured in hundreths of seconds
+        self.delay_hms = m.ceil((1 / fps) * 0.01)
+        self.num_color_bits = m.ceil(m.log2(len(colors)))
+        self.file = None
+        self.prev_frame = None
+        # the last frame added and its dirty rect, written with the next one
+        self.held_frame = None
+        self.frame_count = 0
+
+    def open(self):
+        self.file = open(self.file_name, "wb")
+        self.file.write(header)
+        self.file.write(
+            logical_screen_descriptor(
+                self.width, self.height, self.num_color_bits
+            )  # TODO make this color size a reasonable input
+        )
+        self.file.write(color_table(self.colors, self.num_color_bits))
+        self.file.write(application_control_extension())
+        return self
+
+    def add_frame(self, frame, dirty_rect=None):
+        """dirty_rect is an optional (x, y, width, height) the caller knows
+        holds every pixel that changed since the last frame, so the frames
+        don't have to be compared"""
+        # copy, the caller is free to keep drawing into frame
+        np_frame = np.array(frame, dtype=np.uint8).reshape((self.height, self.width))
+        self.write_planned(self.plan_frame(np_frame, dirty_rect))
+        self.frame_count += 1
+
+    def add_frames(self, frames, workers=1):
+        """add a list of frames. with more than one worker the ways to write
+        each frame are found up front and encoded in a process pool"""
+        if workers <= 1:
+            for frame in frames:
+                self.add_frame(frame)
+            return
+
+        plans = []
+        for frame in frames:
+            np_frame = np.array(frame, dtype=np.uint8)
+            np_frame = np_frame.reshape((self.height, self.width))
+            plans.append(self.plan_frame(np_frame))
+            self.frame_count += 1
+        plans = [plan for plan in plans if plan is not None]
+
+        with spawn_pool(workers) as pool:
+            encoded_frames = pool.map(
+                encode_smallest,
+                [candidates for (candidates, _) in plans],
+                itertools.repeat(self.num_color_bits),
+            )
+            for (_, clear), encoded in zip(plans, encoded_frames):
+                self.write_frame(*encoded, clear)
+
+    def plan_frame(self, np_frame, dirty_rect=None):
+        """hold on to np_frame, and return the frame before it, which can now
+        be planned, as (candidates, clear) for encode_smallest and
+        write_frame. None for the first frame. np_frame None lets go of the
+        last frame"""
+        plan = None
+        if self.held_frame is not None:
+            held_frame, held_rect = self.held_frame
+            plan = self.frame_candidates(held_frame, held_rect, np_frame)
+            self.prev_frame = held_frame
+        self.held_frame = None if np_frame is None else (np_frame, dirty_rect)
+        return plan
+
+    def frame_candidates(self, np_frame, dirty_rect=None, next_frame=None):
+        """the ways np_frame could be written after prev_frame, and whether
+        to clear it away before next_frame"""
+        prev_frame = self.prev_frame
+        transparent_index = 0 if self.useTransparency else None
+        full = (0, 0, self.width, self.height, np_frame, transparent_index)
+
+        clear = False
+        if self.useTransparency:
+            # pixels only go back to transparent when the canvas is cleared,
+            # which takes a full frame before and after the clear
+            if self.encoding == "full":
+                return [full], True
+            clear = next_frame is not None and uncovers_background(np_frame, next_frame)
+            if clear or (
+                prev_frame is not None and uncovers_background(prev_frame, np_frame)
+            ):
+                return [full], clear
+        if prev_frame is None or self.encoding == "full":
+            return [full], clear
+
+        if dirty_rect is None:
+            dirty_rect = find_frame_diff(prev_frame, np_frame)
+        elif dirty_rect[2] <= 0 or dirty_rect[3] <= 0:
+            # nothing changed, a frame needs at least one pixel though
+            dirty_rect = (0, 0, 1, 1)
+        x, y, width, height = dirty_rect
+        box = (slice(y, y + height), slice(x, x + width))
+
+        candidates = []
+        if self.encoding in ["box", "auto"]:
+            candidates.append((x, y, width, height, np_frame[box], transparent_index))
+        if self.encoding in ["masked", "auto"]:
+            masked = mask_unchanged(
+                prev_frame[box], np_frame[box], self.num_color_bits, transparent_index
+            )
+            if masked is not None:
+                candidates.append((x, y, width, height, *masked))
+        if self.encoding == "auto" and (width, height) != (self.width, self.height):
+            candidates.append(full)
+        if not candidates:
+            # every index is in use, so there is nothing to mask with
+            candidates.append((x, y, width, height, np_frame[box], transparent_index))
+        return candidates, clear
+
+    def write_planned(self, plan):
+        if plan is None:
+            return
+        candidates, clear = plan
+        self.write_frame(*encode_smallest(candidates, self.num_color_bits), clear)
+
+    def write_frame(
+        self,
+        x,
+        y,
+        width,
+        height,
+        encoded_image_data,
+        transparent_index=None,
+        clear=False,
+    ):
+        self.file.write(
+            graphic_control_extension(self.delay_hms, transparent_index, clear)
+        )
+        self.file.write(image_descriptor(x, y, width, height))
+        self.file.write(encoded_image_data)
+
+    def close(self, wait=True):
+        """wait is only used by BackgroundGifWriter, frames are already written"""
+        if self.file is None:
+            return
+        self.write_planned(self.plan_frame(None))
+        self.file.write(b"\x3b")
+        self.file.close()
+        self.file = None
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class BackgroundGifWriter(GifWriter):
+    """GifWriter that does the slow LZW encoding off the calling thread.
+
+    add_frame only copies the frame into a bounded queue. A writer thread
+    takes frames off the queue, hands them to a pool of worker processes to
+    encode in parallel, and writes the results to the file in frame order.
+
+    If the writer thread fails, the error is raised by the next add_frame or
+    close. Once closed with wait=False there is no next call, so the thread
+    prints it instead.
+    """
+
+    def __init__(
+        self,
+        file_name,
+        width,
+        height,
+        fps,
+        colors,
+        useTransparency=False,
+        workers=None,
+        max_queued_frames=32,
+        encoding="box",
+    ):
+        super().__init__(
+            file_name, width, height, fps, colors, useTransparency, encoding
         )
-    file_contents += b"\x3b"
+        self.workers = workers
+        self.frames: queue.Queue = queue.Queue(maxsize=max_queued_frames)
+        # frames being encoded before we wait on the oldest one
+        self.max_pending_frames = max_queued_frames
+        self.writer_thread = None
+        self.closing = False
+        # closed with wait=False, nobody is left to raise an error to
+        self.detached = False
+        self.error: Exception | None = None
+
+    def open(self):
+        super().open()
+        self.writer_thread = threading.Thread(target=self.write_frames)
+        self.writer_thread.start()
+        return self
+
+    def add_frame(self, frame, dirty_rect=None):
+        self.raise_error()
+        np_frame = np.array(frame, dtype=np.uint8).reshape((self.height, self.width))
+        self.queue_frame((np_frame, dirty_rect))
+        self.raise_error()
+        self.frame_count += 1
+
+    def queue_frame(self, queued):
+        """blocks if the encoders have fallen max_queued_frames behind, unless
+        the writer thread stopped and the queue will never empty"""
+        while self.writer_thread.is_alive():
+            try:
+                self.frames.put(queued, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def raise_error(self):
+        """raise the writer thread's error, only once"""
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def write_frames(self):
+        try:
+            with spawn_pool(self.workers) as pool:
+                pending = deque()
+                while True:
+                    queued = self.frames.get()
+                    # the last frame is planned once there are no more
+                    plan = self.plan_frame(*(queued or (None,)))
+                    if plan is not None:
+                        candidates, clear = plan
+                        encoding = pool.submit(
+                            encode_smallest, candidates, self.num_color_bits
+                        )
+                        pending.append((encoding, clear))
+                    if queued is None:
+                        break
+
+                    # write whatever has finished, oldest first
+                    while pending and (
+                        pending[0][0].done() or len(pending) > self.max_pending_frames
+                    ):
+                        encoding, clear = pending.popleft()
+                        self.write_frame(*encoding.result(), clear)
+
+                for encoding, clear in pending:
+                    self.write_frame(*encoding.result(), clear)
+        except Exception as e:
+            self.error = e
+            if self.detached:
+                traceback.print_exc()
+        finally:
+            GifWriter.close(self)
+
+    def close(self, wait=True):
+        """finish writing the queued frames. with wait=False this returns
+        straight away and the writer thread closes the file when it is done"""
+        if self.writer_thread is None:
+            return
+        if not self.closing:
+            self.closing = True
+            self.queue_frame(None)
+        if wait:
+            self.writer_thread.join()
+            self.writer_thread = None
+        else:
+            self.detached = True
+        self.raise_error()
+
 
-    with open(file_name, "wb", buffering=0) as f:
-        f.write( file_contents)  # fmt: skip
+def export_image(
+    file_name,
+    frame_data,
+    width,
+    height,
+    fps,
+    colors,
+    useTransparency=False,
+    workers=1,
+    encoding="box",
+):
+    """frame data is a list of frames of data. a frame is a 1d list of color indicies
+    workers > 1 encodes the frames in parallel in that many processes"""
+    with GifWriter(
+        file_name, width, height, fps, colors, useTransparency, encoding
+    ) as gif:
+        gif.add_frames(frame_data, workers)
 
 
 if __name__ == "__main__":
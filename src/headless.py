@@ -0,0 +1,214 @@
+"""Render a spinning model straight to a gif, without opening a window.
+Runs as fast as the cpu allows instead of at the app's frame rate.
+
+python src/headless.py assets/porygon/model.obj --frames 100 --out spin.gif
+python src/headless.py assets/porygon/model.obj --size 640 480 --supersample 2 \
+    --preview preview.gif
+"""
+
+import argparse
+import contextlib
+
+import numpy as np
+
+import gif_exporter
+import obj_parser as obj
+import tiled
+from renderer import (
+    WIDTH,
+    HEIGHT,
+    FPS,
+    Camera,
+    RenderTarget,
+    TransformStage,
+    colors_rgb,
+    cube_colors,
+    cull_tris,
+    draw_tri,
+    draw_tri_edge,
+    face_normals,
+    lambert,
+    nearest_palette_colors,
+    shade_colors,
+    transform_normals,
+    turntable_transforms,
+)
+
+rasterizers = {"edge": draw_tri_edge, "scanline": draw_tri}
+shadings = ["none", "flat", "dither"]
+
+
+def render_turntable(
+    verts,
+    faces,
+    num_frames,
+    rasterize=draw_tri_edge,
+    cull=True,
+    face_colors=cube_colors,
+    shading="flat",
+    targets: list[RenderTarget] | None = None,
+    camera: Camera | None = None,
+):
+    """yield a tuple of each target's frame, for every frame of the model
+    spinning, as the app would draw it. by default there is one target the
+    size of the app's screen. targets reuse their buffers, copy a frame to
+    keep it. face_colors has a palette color for each face, or is cycled
+    through. with a camera the model is drawn in perspective"""
+    if targets is None:
+        targets = [RenderTarget()]
+    transform_stage = TransformStage()
+    base_colors = np.resize(face_colors, len(faces))
+    normals = face_normals(verts, faces)
+
+    # every frame's transform up front, the app starts drawing at frame 1
+    transforms = turntable_transforms(np.arange(1, num_frames + 1))
+    for transform in transforms:
+        render_tris = transform_stage.render_instances(
+            verts, faces, [transform], camera
+        )
+        intensities = lambert(transform_normals(normals, transform))
+        if shading == "none":
+            colors = base_colors
+        else:
+            colors = shade_colors(base_colors, intensities)
+
+        face_ids = transform_stage.face_ids
+        if cull:
+            # in scene units, which every target shows the same part of
+            render_tris, kept, _ = cull_tris(render_tris, WIDTH, HEIGHT)
+            face_ids = face_ids[kept]
+
+        for target in targets:
+            target.clear()
+            if shading == "dither":
+                target.draw_dithered(
+                    render_tris, face_ids, base_colors, intensities, rasterize
+                )
+            else:
+                target.draw_tris(render_tris, colors[face_ids], rasterize)
+        yield tuple(target.frame() for target in targets)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("model", help="obj file to render")
+    parser.add_argument("--frames", type=int, default=100)
+    parser.add_argument("--out", default="spin.gif")
+    parser.add_argument("--fps", type=int, default=FPS)
+    parser.add_argument(
+        "--size", type=int, nargs=2, default=[WIDTH, HEIGHT], metavar=("W", "H")
+    )
+    parser.add_argument(
+        "--supersample",
+        type=int,
+        default=1,
+        help="draw this many times bigger and box filter down to the size",
+    )
+    parser.add_argument(
+        "--preview", help=f"also write a {WIDTH}x{HEIGHT} gif of the same frames"
+    )
+    parser.add_argument("--rasterizer", choices=rasterizers, default="edge")
+    parser.add_argument(
+        "--triangulation",
+        choices=obj.triangulations,
+        default="fan",
+        help="ear_clip splits concave polygons correctly",
+    )
+    parser.add_argument("--shading", choices=shadings, default="flat")
+    parser.add_argument(
+        "--perspective",
+        type=float,
+        metavar="FOV",
+        help="draw in perspective with this vertical field of view in degrees",
+    )
+    parser.add_argument(
+        "--cull",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+        help="drop back faces, the model needs consistent winding",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="encode the gif in this many background processes",
+    )
+    parser.add_argument(
+        "--encoding",
+        choices=gif_exporter.frame_encodings,
+        default="auto",
+        help="how to write each frame after the first, auto picks the smallest",
+    )
+    parser.add_argument(
+        "--raster-workers",
+        type=int,
+        default=0,
+        help="rasterize in tiles on this many processes",
+    )
+    args = parser.parse_args()
+
+    mesh = obj.load_mesh(args.model, triangulation=args.triangulation)
+    colors = nearest_palette_colors(obj.material_colors(args.model, mesh))
+
+    width, height = args.size
+    camera = None
+    if args.perspective:
+        camera = Camera(fov=np.radians(args.perspective))
+    tiler = None
+    if args.raster_workers:
+        tiler = tiled.TiledRasterizer(
+            width * args.supersample,
+            height * args.supersample,
+            workers=args.raster_workers,
+        )
+    outputs = {args.out: RenderTarget(width, height, args.supersample, tiler=tiler)}
+    if args.preview:
+        outputs[args.preview] = RenderTarget()
+
+    with contextlib.ExitStack() as stack:
+        if tiler is not None:
+            stack.callback(tiler.close)
+        gifs = []
+        for file_name, target in outputs.items():
+            if args.workers > 1:
+                gif = gif_exporter.BackgroundGifWriter(
+                    file_name,
+                    target.width,
+                    target.height,
+                    args.fps,
+                    colors_rgb,
+                    True,
+                    args.workers,
+                    encoding=args.encoding,
+                )
+            else:
+                gif = gif_exporter.GifWriter(
+                    file_name,
+                    target.width,
+                    target.height,
+                    args.fps,
+                    colors_rgb,
+                    True,
+                    args.encoding,
+                )
+            gifs.append(stack.enter_context(gif))
+
+        for frames in render_turntable(
+            mesh.positions,
+            mesh.faces,
+            args.frames,
+            rasterizers[args.rasterizer],
+            args.cull,
+            colors[mesh.material_ids],
+            args.shading,
+            list(outputs.values()),
+            camera,
+        ):
+            for gif, frame in zip(gifs, frames):
+                gif.add_frame(frame)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,47 +1,485 @@
+import dataclasses
+import hashlib
+import json
+import os
+
 import numpy as np
 
+# compiled meshes are saved next to the obj with this suffix
+cache_suffix = ".meshcache"
+# bump when the parser's output changes, so old caches get rebuilt
+cache_version = 4
+cache_magic = b"PYXMESH\x00"
+# array data starts on a multiple of this many bytes
+cache_alignment = 64
+
+
+@dataclasses.dataclass
+class Mesh:
+    """everything in an obj file, as contiguous arrays.
+    index arrays are -1 where a face left that index out"""
+
+    # (N,4) x, y, z, 1
+    positions: np.ndarray
+    # (T,2) u, v
+    uvs: np.ndarray
+    # (K,3) x, y, z
+    normals: np.ndarray
+    # (M,3) triangles as indices into positions, uvs and normals
+    faces: np.ndarray
+    uv_faces: np.ndarray
+    normal_faces: np.ndarray
+    # (M,) index into materials for each triangle, -1 for no material
+    material_ids: np.ndarray
+    # names from the usemtl lines, in the order they first appear
+    materials: np.ndarray
+    # mtl files from the mtllib lines, relative to the obj
+    material_libraries: np.ndarray
+
+
+def load(file_name, use_cache=True, triangulation="fan"):
+    """(N,4) vertex array and (M,3) face index array of an obj file"""
+    mesh = load_mesh(file_name, use_cache, triangulation)
+    return mesh.positions, mesh.faces
+
+
+def load_mesh(file_name, use_cache=True, triangulation="fan") -> Mesh:
+    """The first load saves the parsed arrays to a binary cache next to
+    the obj, later loads memory map them straight from the cache instead of
+    parsing again. Arrays from the cache are read only.
+
+    triangulation is one of triangulations, see poly_to_tri."""
+    options = {"triangulation": triangulation}
+    if use_cache:
+        try:
+            cached = load_cache(file_name, options)
+        except (OSError, ValueError):
+            cached = None
+        if cached is not None:
+            return Mesh(**cached)
+
+    mesh = parse(file_name, triangulation)
+
+    if use_cache:
+        try:
+            save_cache(file_name, dataclasses.asdict(mesh), options)
+        except OSError:
+            pass  # e.g. a read only directory, we just parse every time
+    return mesh
+
+
+# keywords of the lines that are parsed in bulk, anything else is 0
+POSITION, UV, NORMAL, FACE = 1, 2, 3, 4
+keywords = {POSITION: b"v", UV: b"vt", NORMAL: b"vn", FACE: b"f"}
+
+
+def parse(file_name, triangulation="fan") -> Mesh:
+    """parse an obj file, triangulating its polygons.
+    each run of lines with the same keyword is converted to numbers in one
+    go, only the few other lines like usemtl are looked at one by one"""
+    with open(file_name, "rb") as f:
+        data = f.read().replace(b"\r", b"")
+    if not data.endswith(b"\n"):
+        data += b"\n"
+
+    line_ends = np.flatnonzero(np.frombuffer(data, dtype=np.uint8) == ord("\n"))
+    line_starts = np.concatenate([[0], line_ends[:-1] + 1])
+    line_kinds = classify_lines(data, line_starts)
+
+    # lines where the kind changes
+    changes = np.flatnonzero(line_kinds[1:] != line_kinds[:-1]) + 1
+    run_starts = np.concatenate([[0], changes]).tolist()
+    run_ends = np.concatenate([changes, [len(line_kinds)]]).tolist()
+
+    vertex_data: dict[int, list[np.ndarray]] = {POSITION: [], UV: [], NORMAL: []}
+    # number of positions, uvs and normals defined so far
+    counts = np.zeros(3, dtype=np.intp)
+    # faces grouped by their number of corners
+    face_groups: dict[int, list[FaceGroup]] = {}
+    material_names: dict[bytes, int] = {}
+    material_id = -1
+    material_libraries = []
+    for first, last in zip(run_starts, run_ends):
+        kind = line_kinds[first]
+        text = data[line_starts[first] : line_ends[last - 1]]
+        if kind == FACE:
+            for group in parse_faces(text, first, counts, material_id):
+                face_groups.setdefault(group.num_corners(), []).append(group)
+        elif kind:
+            width = 2 if kind == UV else 3
+            values = parse_floats(text, keywords[kind], last - first, width)
+            vertex_data[kind].append(values)
+            counts[kind - 1] += len(values)
+        else:
+            for line in text.split(b"\n"):
+                tokens = line.split(None, 1)
+                if len(tokens) == 2 and tokens[0] == b"usemtl":
+                    name = tokens[1].strip()
+                    material_id = material_names.setdefault(name, len(material_names))
+                elif len(tokens) == 2 and tokens[0] == b"mtllib":
+                    material_libraries += tokens[1].decode().split()
+
+    positions = np.ones((counts[0], 4))
+    positions[:, :3] = concatenate_rows(vertex_data[POSITION], 3)
+    uvs = concatenate_rows(vertex_data[UV], 2)
+    normals = concatenate_rows(vertex_data[NORMAL], 3)
 
-def load(file_name):
-    vertices = []
-    faces = []
+    triangulated = [
+        FaceGroup.concatenate(groups).triangulate(positions, triangulation)
+        for groups in face_groups.values()
+    ]
+    if triangulated:
+        line_numbers, corners, material_ids = (
+            np.concatenate(arrays) for arrays in zip(*triangulated)
+        )
+    else:
+        line_numbers = np.empty(0, dtype=np.intp)
+        corners = np.empty((0, 3, 3), dtype=np.intp)
+        material_ids = np.empty(0, dtype=np.intp)
+    if len(triangulated) > 1:
+        # put the triangles back in the order their faces were in the file
+        order = np.argsort(line_numbers, kind="stable")
+        corners = corners[order]
+        material_ids = material_ids[order]
+
+    return Mesh(
+        positions,
+        uvs,
+        normals,
+        np.ascontiguousarray(corners[:, :, 0]),
+        np.ascontiguousarray(corners[:, :, 1]),
+        np.ascontiguousarray(corners[:, :, 2]),
+        material_ids.astype(np.int32),
+        np.array([name.decode() for name in material_names], dtype=str),
+        np.array(material_libraries, dtype=str),
+    )
+
+
+def parse_mtl(file_name) -> dict[str, np.ndarray]:
+    """diffuse color (Kd) of each material in an mtl file"""
+    diffuse = {}
+    name = None
     with open(file_name) as f:
         for line in f:
-            tokens = line.strip().split(" ")
-            if tokens[0] == "v":
-                tri = [float(x) for x in tokens[1:4]]
-                vertices.append(np.array((*tri, 1.0), dtype=float))
-            elif tokens[0] == "f":
-                faces.append([int(x.split("/")[0]) - 1 for x in tokens[1:]])
-    tris = poly_to_tri(faces, vertices)
-
-    return vertices, tris
-
-
-def poly_to_tri(faces, vertices):
-    new_faces = []
-    for f in faces:
-        n = len(f)
-        if n == 3:
-            new_faces.append(f)
-        elif n == 4:
-            f1 = f[:3]
-            f2 = [f[0], f[2], f[3]]
-            new_faces.append(f1)
-            new_faces.append(f2)
-        elif n > 4:
-            verts = np.array([vertices[v] for v in f])
-            center_vert = np.mean(verts, axis=0)
-            vertices.append(center_vert)
-            center_index = len(vertices) - 1
-            for i, v in enumerate(verts):
-                new_faces.append([f[i], f[(i + 1) % n], center_index])
-
-            # TODO implement
-            # define a vertext that is the center,
-            # then go around the ring, and connect each two
-            # vert indexes to center
-            pass
-    return new_faces
+            tokens = line.split()
+            if len(tokens) >= 2 and tokens[0] == "newmtl":
+                name = tokens[1]
+            elif len(tokens) >= 4 and tokens[0] == "Kd" and name is not None:
+                diffuse[name] = np.array(tokens[1:4], dtype=float)
+    return diffuse
+
+
+def material_colors(file_name, mesh: Mesh, default=(1.0, 1.0, 1.0)) -> np.ndarray:
+    """(len(mesh.materials) + 1, 3) diffuse rgb of each material of the obj
+    file_name, from 0 to 1. Materials that aren't in its mtl files get the
+    default, which is also the last row so a material id of -1 indexes it"""
+    diffuse = {}
+    directory = os.path.dirname(file_name)
+    for library in mesh.material_libraries:
+        try:
+            diffuse.update(parse_mtl(os.path.join(directory, library)))
+        except OSError:
+            pass  # the model is still usable without its colors
+    names = [*mesh.materials.tolist(), None]
+    return np.array([diffuse.get(name, default) for name in names], dtype=float)
+
+
+def is_space(chars: np.ndarray) -> np.ndarray:
+    return (chars == ord(" ")) | (chars == ord("\t"))
+
+
+def classify_lines(data: bytes, line_starts: np.ndarray) -> np.ndarray:
+    """the keyword of each line, from its first three characters"""
+    chars = np.frombuffer(data + b"   ", dtype=np.uint8)
+    first, second, third = (chars[line_starts + i] for i in range(3))
+    v = first == ord("v")
+    return np.select(
+        [
+            v & is_space(second),
+            v & (second == ord("t")) & is_space(third),
+            v & (second == ord("n")) & is_space(third),
+            (first == ord("f")) & is_space(second),
+        ],
+        [POSITION, UV, NORMAL, FACE],
+        0,
+    )
+
+
+def parse_floats(text: bytes, keyword: bytes, num_lines: int, width: int):
+    """(num_lines, width) array of the first width numbers on each line"""
+    try:
+        values = np.fromstring(text.replace(keyword, b" "), sep=" ")
+    except ValueError:
+        values = None
+    if values is not None and values.size == num_lines * width:
+        return values.reshape(-1, width)
+    # some lines have extra values, like a w or vertex colors
+    return np.array(
+        [line.split()[1 : width + 1] for line in text.split(b"\n")], dtype=float
+    )
+
+
+def concatenate_rows(arrays: list[np.ndarray], width: int) -> np.ndarray:
+    if not arrays:
+        return np.empty((0, width))
+    return np.concatenate(arrays)
+
+
+def parse_faces(text: bytes, first_line: int, counts, material_id):
+    """FaceGroups of a run of f lines, one for each shape of face in it"""
+    chars = np.frombuffer(text, dtype=np.uint8)
+    newlines = chars == ord("\n")
+    # line of each character in the run
+    line_ids = np.cumsum(newlines) - newlines
+    num_lines = int(newlines.sum()) + 1
+
+    # a token starts wherever a space is followed by something else
+    spaces = is_space(chars) | newlines
+    token_starts = ~spaces
+    token_starts[1:] &= spaces[:-1]
+    # minus the f at the start of the line
+    num_corners = np.bincount(line_ids[token_starts], minlength=num_lines) - 1
+    num_slashes = np.bincount(line_ids[chars == ord("/")], minlength=num_lines)
+    # "1//3" has two slashes and will become "1/0/3" so it has three fields
+    num_fields, mixed = np.divmod(num_slashes, np.maximum(num_corners, 1))
+    num_fields += 1
+    if mixed.any():
+        raise ValueError("all corners of a face must use the same v/vt/vn format")
+
+    text = text.replace(b"f", b" ").replace(b"//", b"/0/").replace(b"/", b" ")
+    values = np.fromstring(text, dtype=np.intp, sep=" ")
+    num_values = num_corners * num_fields
+    if values.size != num_values.sum():
+        raise ValueError(f"could not read the faces on lines {first_line + 1} on")
+    offsets = np.cumsum(num_values) - num_values
+
+    # faces need at least three corners
+    shapes = np.where(num_corners >= 3, num_corners * 4 + num_fields, 0)
+    for shape in np.flatnonzero(np.bincount(shapes)[1:]) + 1:
+        corners, fields = divmod(int(shape), 4)
+        lines = np.flatnonzero(shapes == shape)
+        gather = offsets[lines, None] + np.arange(corners * fields)
+        face_values = values[gather].reshape(-1, corners, fields)
+
+        indices = np.zeros((len(lines), corners, 3), dtype=np.intp)
+        indices[:, :, :fields] = face_values
+        # obj indices start at 1, a missing index is 0 and becomes -1,
+        # negative indices count back from the last one defined
+        indices = np.where(indices < 0, indices + counts, indices - 1)
+        yield FaceGroup(lines + first_line, indices, np.full(len(lines), material_id))
+
+
+@dataclasses.dataclass
+class FaceGroup:
+    """faces that all have the same number of corners"""
+
+    # line number of each face, to restore the file order
+    line_numbers: np.ndarray
+    # (F, corners, 3) zero based position, uv and normal indices
+    indices: np.ndarray
+    material_ids: np.ndarray
+
+    def num_corners(self) -> int:
+        return self.indices.shape[1]
+
+    @classmethod
+    def concatenate(cls, groups: list["FaceGroup"]) -> "FaceGroup":
+        return cls(
+            *(
+                np.concatenate([getattr(group, field.name) for group in groups])
+                for field in dataclasses.fields(cls)
+            )
+        )
+
+    def triangulate(self, positions, method="fan"):
+        """line numbers, (T,3,3) corner indices and material ids
+        of the triangles covering each face"""
+        n = self.num_corners()
+        tris = poly_to_tri(self.indices[:, :, 0], positions, method)
+        faces = np.arange(len(self.indices))[:, None, None]
+        corners = self.indices[faces, tris].reshape(-1, 3, 3)
+        line_numbers = np.repeat(self.line_numbers, n - 2)
+        material_ids = np.repeat(self.material_ids, n - 2)
+        return line_numbers, corners, material_ids
+
+
+def source_hash(file_name) -> str:
+    with open(file_name, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def save_cache(file_name, arrays: dict[str, np.ndarray], options=None):
+    """write arrays to the cache file of file_name.
+    the file is a json header describing the source file, the options it
+    was parsed with and where each array is, followed by the raw array data"""
+    stat = os.stat(file_name)
+    array_layouts: dict[str, dict] = {}
+    header = {
+        "version": cache_version,
+        "options": options or {},
+        "mtime_ns": stat.st_mtime_ns,
+        "size": stat.st_size,
+        "sha1": source_hash(file_name),
+        "arrays": array_layouts,
+    }
+
+    # offsets are relative to the end of the header
+    offset = 0
+    for name, array in arrays.items():
+        array_layouts[name] = {
+            "dtype": array.dtype.str,
+            "shape": array.shape,
+            "offset": offset,
+        }
+        offset += -(-array.nbytes // cache_alignment) * cache_alignment
+
+    header_bytes = json.dumps(header).encode()
+    header_size = len(cache_magic) + 4 + len(header_bytes)
+    padding = -header_size % cache_alignment
+
+    # write to a temporary file first so a half written cache is never read
+    temp_name = f"{file_name}{cache_suffix}.{os.getpid()}.tmp"
+    with open(temp_name, "wb") as f:
+        f.write(cache_magic)
+        f.write(len(header_bytes).to_bytes(4, "little"))
+        f.write(header_bytes)
+        f.write(b"\x00" * padding)
+        for array in arrays.values():
+            data = np.ascontiguousarray(array).tobytes()
+            f.write(data)
+            f.write(b"\x00" * (-len(data) % cache_alignment))
+    os.replace(temp_name, file_name + cache_suffix)
+
+
+def load_cache(file_name, options=None) -> dict[str, np.ndarray] | None:
+    """memory map the arrays saved for file_name, or None if there is
+    no cache, it is out of date or was parsed with different options"""
+    cache_name = file_name + cache_suffix
+    if not os.path.exists(cache_name):
+        return None
+
+    with open(cache_name, "rb") as f:
+        if f.read(len(cache_magic)) != cache_magic:
+            return None
+        header_length = int.from_bytes(f.read(4), "little")
+        header = json.loads(f.read(header_length))
+    if header["version"] != cache_version or header["options"] != (options or {}):
+        return None
+
+    # only hash the obj again if it looks like it changed
+    stat = os.stat(file_name)
+    unchanged = (
+        header["mtime_ns"] == stat.st_mtime_ns and header["size"] == stat.st_size
+    )
+    if not unchanged and header["sha1"] != source_hash(file_name):
+        return None
+
+    header_size = len(cache_magic) + 4 + header_length
+    data_start = header_size + (-header_size % cache_alignment)
+    arrays = {}
+    for name, info in header["arrays"].items():
+        shape = tuple(info["shape"])
+        if 0 in shape:
+            # can't memory map nothing
+            arrays[name] = np.empty(shape, dtype=info["dtype"])
+            continue
+        arrays[name] = np.memmap(
+            cache_name,
+            dtype=info["dtype"],
+            mode="r",
+            offset=data_start + info["offset"],
+            shape=shape,
+        )
+    return arrays
+
+
+def poly_to_tri(polygons: np.ndarray, vertices: np.ndarray, method="fan"):
+    """triangles covering each of F polygons with n corners, given as an
+    (F,n) array of vertex indices. Returns (F,n-2,3) corner numbers, so the
+    uv and normal indices of a corner can be looked up the same way.
+
+    fan is only right for convex polygons, ear_clip also handles concave
+    ones but has to look at the vertex positions."""
+    num_polygons, n = polygons.shape
+    if method == "ear_clip" and n > 3:
+        return ear_clip(vertices[polygons, :3])
+    if method not in triangulations:
+        raise ValueError(f"unknown triangulation {method!r}")
+
+    # every polygon is split the same way, from its first corner
+    fan = np.stack(
+        [np.zeros(n - 2, dtype=np.intp), np.arange(1, n - 1), np.arange(2, n)],
+        axis=1,
+    )
+    return np.broadcast_to(fan, (num_polygons, n - 2, 3))
+
+
+def cross_2d(a, b, c):
+    """z of (b - a) x (c - a), positive when a, b, c turn counter clockwise"""
+    ab = b - a
+    ac = c - a
+    return ab[..., 0] * ac[..., 1] - ab[..., 1] * ac[..., 0]
+
+
+def ear_clip(points: np.ndarray) -> np.ndarray:
+    """(F,n-2,3) corner numbers of (F,n,3) polygon points.
+    all polygons have the same number of corners, so one ear is cut off
+    each of them at a time"""
+    num_polygons, n, _ = points.shape
+    rows = np.arange(num_polygons)
+
+    # flatten each polygon by dropping the axis its normal is closest to
+    normals = np.cross(points, np.roll(points, -1, axis=1)).sum(axis=1)
+    kept_axes = np.array([[1, 2], [0, 2], [0, 1]])[np.abs(normals).argmax(axis=1)]
+    flat = np.take_along_axis(points, kept_axes[:, None, :], axis=2)
+
+    # ears turn the same way as their polygon
+    x, y = flat[..., 0], flat[..., 1]
+    area = (x * np.roll(y, -1, axis=1) - np.roll(x, -1, axis=1) * y).sum(axis=1)
+    winding = np.where(area < 0, -1.0, 1.0)[:, None]
+
+    # for k remaining corners, (ear, corner) False for the ear's own corners
+    own_corners = {}
+    for k in range(4, n + 1):
+        offsets = (np.arange(k)[None, :] - np.arange(k)[:, None]) % k
+        own_corners[k] = (offsets > 1) & (offsets < k - 1)
+
+    tris = np.empty((num_polygons, n - 2, 3), dtype=np.intp)
+    remaining = np.tile(np.arange(n), (num_polygons, 1))
+    for t in range(n - 3):
+        before = np.roll(remaining, 1, axis=1)
+        after = np.roll(remaining, -1, axis=1)
+        a = flat[rows[:, None], before]
+        b = flat[rows[:, None], remaining]
+        c = flat[rows[:, None], after]
+        convex = cross_2d(a, b, c) * winding > 0
+
+        # (F, ear, corner) whether another corner is inside or on the ear,
+        # which would make cutting it off leave a bad polygon
+        p = b[:, None, :, :]
+        a, b, c = a[:, :, None], b[:, :, None], c[:, :, None]
+        w = winding[:, :, None]
+        inside = (
+            (cross_2d(a, b, p) * w >= 0)
+            & (cross_2d(b, c, p) * w >= 0)
+            & (cross_2d(c, a, p) * w >= 0)
+            & own_corners[n - t]
+        )
+        ears = convex & ~inside.any(axis=2)
+
+        # degenerate polygons with no ears just lose their first corner
+        ear = ears.argmax(axis=1)
+        tris[:, t] = np.stack(
+            [before[rows, ear], remaining[rows, ear], after[rows, ear]], axis=1
+        )
+        keep = np.arange(n - t) != ear[:, None]
+        remaining = remaining[keep].reshape(num_polygons, n - t - 1)
+
+    tris[:, n - 3] = remaining
+    return tris
+
+
+triangulations = ["fan", "ear_clip"]
 
 
 if __name__ == "__main__":
@@ -0,0 +1,1562 @@
+import collections
+import dataclasses
+import functools
+import math as m
+import random
+from enum import Enum
+from typing import TypeVar, Any, Iterable, Annotated, Literal
+import itertools
+import traceback
+import numpy as np
+import numpy.typing as npt
+
+import pyxel
+
+T = TypeVar("T")
+
+DType = TypeVar("DType", bound=np.generic)
+Mat4 = Annotated[npt.NDArray[DType], Literal[4, 4]]
+Vec3 = Annotated[npt.NDArray[DType], Literal[3]]
+Vec4 = Annotated[npt.NDArray[DType], Literal[4]]
+# a mesh is an (N,4) array of vertices and an (M,3) array of vertex indices
+VertArray = Annotated[npt.NDArray[DType], Literal["N", 4]]
+FaceArray = Annotated[npt.NDArray[DType], Literal["M", 3]]
+TriArray = Annotated[npt.NDArray[DType], Literal["M", 3, 3]]
+
+
+WIDTH = 160
+HEIGHT = 120
+FPS = 15
+
+BLUE = 1
+PURPLE = 2
+TEAL = 3
+ORANGE = 9
+
+
+@dataclasses.dataclass
+class Buffer:
+    """Preallocated 2D numpy array of pixels, indexed [y, x].
+    Reuse it between frames by calling fill instead of making a new one"""
+
+    contents: npt.NDArray[Any]
+    width: int
+    height: int
+    initial_value: Any
+    # index of the cartesian origin
+    origin_x: int
+    origin_y: int
+
+    def __init__(
+        self, width: int, height: int, initial_value: Any, dtype: Any = np.uint8
+    ):
+        self.width = width
+        self.height = height
+        self.initial_value = initial_value
+        self.contents = np.full((height, width), initial_value, dtype=dtype)
+        self.origin_x = width // 2
+        self.origin_y = height // 2
+
+    @classmethod
+    def wrap(cls, contents: npt.NDArray[Any], initial_value: Any) -> "Buffer":
+        """a buffer using an existing 2D array, like one in shared memory"""
+        buffer = cls.__new__(cls)
+        buffer.height, buffer.width = contents.shape
+        buffer.initial_value = initial_value
+        buffer.contents = contents
+        buffer.origin_x = buffer.width // 2
+        buffer.origin_y = buffer.height // 2
+        return buffer
+
+    def view(self, left: int, top: int, width: int, height: int) -> "Buffer":
+        """a buffer sharing the pixels of a rectangle of this one, with the
+        same cartesian coordinates, so drawing into it only touches that
+        rectangle"""
+        view = Buffer.wrap(
+            self.contents[top : top + height, left : left + width], self.initial_value
+        )
+        view.origin_x = self.origin_x - left
+        view.origin_y = self.origin_y - top
+        return view
+
+    def fill(self, value: Any = None):
+        """clear the buffer in place, defaults to the initial value"""
+        self.contents.fill(self.initial_value if value is None else value)
+
+    def get_index(self, x: int, y: int) -> tuple[int, int]:
+        if x >= self.width or x < 0:
+            # print(f"x is out of range: {x=},{y=}")
+            raise Exception(f"x is out of range: {x=},{y=}")
+
+        if y >= self.height or y < 0:
+            # print(f"x is out of range: {x=},{y=}")
+            raise Exception(f"y is out of range: {x=},{y=}")
+
+        return (y, x)
+
+    def set(self, x: int, y: int, value: Any):
+        try:
+            index = self.get_index(x, y)
+            self.contents[index] = value
+        except:
+            pass
+            # print(f"tried to set x or y out of range: {x=},{y=}")
+
+    def get(self, x: int, y: int) -> Any:
+        try:
+            index = self.get_index(x, y)
+        except ():
+            # print(f"tried to get x or y out of range: {x=},{y=}")
+            traceback.print_exc()
+            return 0
+        return self.contents[index]
+
+    def set_span(self, x: int, y: int, length: int, values: Any, where: Any = True):
+        """write a horizontal run of length values starting at (x, y).
+        where is an optional boolean mask of which values to write"""
+        span = self.contents[y, x : x + length]
+        np.copyto(span, values, casting="unsafe", where=where)
+
+    def set_masked(self, x: int, y: int, mask: Any, values: Any):
+        """write values into the block whose top left corner is (x, y),
+        only where mask is True. values is a scalar or has the mask's shape"""
+        rows, columns = np.shape(mask)
+        block = self.contents[y : y + rows, x : x + columns]
+        np.copyto(block, values, casting="unsafe", where=mask)
+
+    def cartesian_to_index(self, cartX: int, cartY: int) -> tuple[int, int]:
+        # y goes up the screen. (0, 0) is the middle pixel when the size is
+        # odd and the one right of and below the middle when it is even,
+        # unless the origin is moved
+        x = cartX + self.origin_x
+        y = (-1 * cartY) + self.origin_y
+        return (x, y)
+
+    def set_cartesian(self, cartX: int, cartY: int, value: Any):
+        self.set(*self.cartesian_to_index(cartX, cartY), value)
+
+    def get_cartesian(self, cartX: int, cartY: int) -> Any:
+        # print(f"get_cartesian {cartX=}, {cartY=}, {self.width=}")
+        return self.get(*self.cartesian_to_index(cartX, cartY))
+
+    def draw(self, image: pyxel.Image | None = None, rect=None, normalize_depth=False):
+        """copy the buffer to the screen, or another pyxel image, in one go.
+        rect is an optional (x, y, width, height) to only copy part of it.
+        depth buffers are shown with z_pallette, a color every 6 scene units.
+        normalize_depth spreads the depths drawn over the whole palette
+        instead, for a camera's depth, which is 0 to 1 from near to far"""
+        x, y, width, height = rect or (0, 0, self.width, self.height)
+        if width <= 0 or height <= 0:
+            return
+        contents = self.contents[y : y + height, x : x + width]
+        if np.issubdtype(contents.dtype, np.floating):
+            z = contents
+            finite = np.isfinite(z)
+            if normalize_depth and finite.any():
+                nearest, farthest = z[finite].min(), z[finite].max()
+                spread = (z - nearest) / max(farthest - nearest, 1e-12)
+                shades = np.clip(
+                    np.where(finite, spread, 0) * len(z_pallette),
+                    0,
+                    len(z_pallette) - 1,
+                ).astype(int)
+            else:
+                shades = (np.where(finite, z, 0) / 6 % len(z_pallette)).astype(int)
+            colors = np.where(finite, z_pallette[shades], 0)
+        else:
+            colors = contents
+
+        if image is None:
+            image = pyxel.screen
+        pixels = np.ctypeslib.as_array(image.data_ptr())
+        pixels = pixels.reshape(image.height, image.width)
+        pixels[y : y + height, x : x + width] = colors
+
+
+z_pallette = np.array([8, 9, 10, 11, 12, 5, 1, 2], dtype=np.uint8)
+
+
+@dataclasses.dataclass
+class Point:
+    x: float
+    y: float
+    z: float
+
+    def __repr__(self):
+        return f" x  = {self.x:10.2f} y = {self.y:10.2f} z = {self.z:10.2f}"
+
+    def as_tuple(self):
+        return (self.x, self.y, self.z)
+
+    def __sub__(self, other):
+        deltaX = self.x - other.x
+        deltaY = self.y - other.y
+        deltaZ = self.z - other.z
+        return Point(deltaX, deltaY, deltaZ)
+
+    def length(self):
+        return m.sqrt(self.x**2 + self.y**2 + self.z**2)
+
+
+@dataclasses.dataclass
+class Line:
+    p1: Point
+    p2: Point
+
+    def x(self, y: float) -> float:
+        p1 = self.p1
+        p2 = self.p2
+        if p1.x == p2.x:
+            return p1.x
+
+        slope = (p1.y - p2.y) / (p1.x - p2.x)
+        b = p2.y - (slope * p2.x)
+        return (y - b) / slope
+
+
+def argmin(a):
+    return min(range(len(a)), key=lambda x: a[x])
+
+
+def argmax(a):
+    return max(range(len(a)), key=lambda x: a[x])
+
+
+class TriType(Enum):
+    UP = 0
+    DOWN = 1
+    STANDARD = 2
+    HORIZONTAL_LINE = 3
+    VERTICAL_LINE = 4
+
+
+def tris_from_verts(
+    vertices: VertArray, faces: FaceArray, out: TriArray | None = None
+) -> TriArray:
+    """gather the x,y,z of each face's vertices into an (M,3,3) array.
+    (K,N,4) vertices of K instances give (K,M,3,3)"""
+    return np.take(vertices[..., :3], faces, axis=-2, out=out)
+
+
+def mat_times_vec(
+    mat: list[list[float]], vec: tuple[float, float, float, float]
+) -> list[float]:
+    xp = dot(vec, mat[0])
+    yp = dot(vec, mat[1])
+    zp = dot(vec, mat[2])
+    wp = dot(vec, mat[3])
+    return [xp, yp, zp, wp]
+
+
+def transform_verts(
+    verts: VertArray, transform: Mat4, out: VertArray | None = None
+) -> VertArray:
+    """apply transform to every vertex with a single matrix multiply.
+    a (K,4,4) stack of transforms gives (K,N,4), a copy for each"""
+    return np.matmul(verts, np.swapaxes(transform, -1, -2), out=out)
+
+
+def tranpose(mat: list[list[float]]) -> list[list[float]]:
+    # does not work :(
+    return [[mat[j][i] for i, j in itertools.product(range(4), repeat=2)]]
+
+
+def dot(v1: Iterable[float], v2: Iterable[float]) -> float:
+    elementwise = [a * b for a, b in zip(v1, v2)]
+    return sum(elementwise)
+
+
+def create_test_mat(size: int):
+    mat = [list((i, i + size)) for i in range(0, size**2, size)]
+    return [float(mat[i][j]) for i, j in itertools.product(range(4), repeat=2)]
+
+
+def characterize_tri(tri: list[tuple[float, float, float]]) -> TriType:
+    p1 = Point(*tri[0])
+    p2 = Point(*tri[1])
+    p3 = Point(*tri[2])
+    # you can chain things 0.o
+    if p1.x == p2.x == p3.x:
+        # print("All 3 x values are equal. I can't draw that!")
+        raise Exception("All 3 x values are equal. I can't draw that!")
+    if p1.y == p2.y == p3.y:
+        # print("All 3 y values are equal. I can't draw that!")
+        # print(f"{p1=}\n{p2=}\n{p3=}")
+        raise Exception("All 3 y values are equal. I can't draw that!")
+
+    if p1.y == p2.y:
+        pOffLine = p3
+        line_y_location = p1.y
+    elif p1.y == p3.y:
+        pOffLine = p2
+        line_y_location = p1.y
+    elif p2.y == p3.y:
+        pOffLine = p1
+        line_y_location = p2.y
+    else:
+        return TriType.STANDARD
+
+    if pOffLine.y > line_y_location:
+        return TriType.UP
+    else:
+        return TriType.DOWN
+
+
+def z_vornoi_estimate(p1: Point, p2: Point, p3: Point, pUnkown: Point) -> float:
+    deltaP1 = p1 - pUnkown
+    distanceP1 = deltaP1.length()
+
+    deltaP2 = p2 - pUnkown
+    distanceP2 = deltaP2.length()
+
+    deltaP3 = p3 - pUnkown
+    distanceP3 = deltaP3.length()
+
+    closestPointIndex = argmin([distanceP1, distanceP2, distanceP3])
+    closestPoint = [p1, p2, p3][closestPointIndex]
+    return closestPoint.z
+
+
+def z_estimate(p1: Point, p2: Point, p3: Point, pUnkown: Point) -> float:
+    w1 = ((p2.y - p3.y) * (pUnkown.x - p3.x) + (p3.x - p2.x) * (pUnkown.y - p3.y)) / (
+        (p2.y - p3.y) * (p1.x - p3.x) + (p3.x - p2.x) * (p1.y - p3.y)
+    )
+
+    w2 = ((p3.y - p1.y) * (pUnkown.x - p3.x) + (p1.x - p3.x) * (pUnkown.y - p3.y)) / (
+        (p2.y - p3.y) * (p1.x - p3.x) + (p3.x - p2.x) * (p1.y - p3.y)
+    )
+
+    w3 = 1 - w1 - w2
+
+    z_weighted_average = p1.z * w1 + p2.z * w2 + p3.z * w3
+    # print(f"{w1=} {w2=} {w3=}")
+    # print(f"{z_weighted_average=}")
+    return z_weighted_average
+
+
+def plane_gradients(p1: Point, p2: Point, p3: Point, values):
+    """value at the cartesian origin, and change per pixel in x and in y, of
+    attributes that are linear across the triangle. the rasterizer steps by
+    these instead of solving for every pixel. values has a row for each
+    corner, with a column per attribute, like depth, color index or uv"""
+    values = np.asarray(values, dtype=float)
+    area = edge_function(p1.x, p1.y, p2.x, p2.y, p3.x, p3.y)
+    d2 = values[1] - values[0]
+    d3 = values[2] - values[0]
+    dx = (d2 * (p3.y - p1.y) - d3 * (p2.y - p1.y)) / area
+    dy = (d3 * (p2.x - p1.x) - d2 * (p3.x - p1.x)) / area
+    origin = values[0] - dx * p1.x - dy * p1.y
+    return origin, dx, dy
+
+
+def draw_tri(
+    tri: list[tuple[float, float, float]],
+    color: int,
+    pixel_buffer: Buffer,
+    z_buffer: Buffer,
+    depth_plane=None,
+):
+    """scanline rasterizer, clipped to the buffer. depth_plane is the depth's
+    plane_gradients, worked out once for the whole triangle"""
+    # trying to sort for debugging z value dependence on order
+    tri = sorted(tri, key=lambda p: p[1])
+    points_to_process = tri[:]
+
+    p1 = Point(*tri[0][:3])
+    p2 = Point(*tri[1][:3])
+    p3 = Point(*tri[2][:3])
+
+    y_min = min(p1.y, p2.y, p3.y)
+    y_max = max(p1.y, p2.y, p3.y)
+
+    try:
+        tri_type = characterize_tri(tri)
+    except:
+        # print("couldn't characterize triangle to a drawable type")
+        # print("unidentifiable triangle:")
+        # print(p1, p2, p3, sep="\n")
+        return
+
+    if depth_plane is None:
+        if edge_function(p1.x, p1.y, p2.x, p2.y, p3.x, p3.y) == 0:
+            return
+        depth_plane = plane_gradients(p1, p2, p3, [p1.z, p2.z, p3.z])
+    z_origin, dz_dx, dz_dy = (float(d) for d in depth_plane)
+
+    # print(f"{tri_type=}")
+    # print(p1,p2,p3,sep="\n")
+
+    if tri_type == TriType.DOWN:
+        bottom_vertex_index = argmin([p1.y, p2.y, p3.y])
+        bottom = Point(*tri[bottom_vertex_index])
+        del points_to_process[bottom_vertex_index]
+
+        xs = [p[0] for p in points_to_process]
+        left_vertex_index = argmin(xs)
+        left = Point(*points_to_process[left_vertex_index])
+        del points_to_process[left_vertex_index]
+
+        right = Point(*points_to_process[0])
+
+        # Find line on the left side
+        line_l = Line(left, bottom)
+        # Find line on the right side
+        line_r = Line(bottom, right)
+    elif tri_type == TriType.UP:
+        top_vertex_index = argmax([p1.y, p2.y, p3.y])
+        top = Point(*tri[top_vertex_index])
+        del points_to_process[top_vertex_index]
+
+        xs = [p[0] for p in points_to_process]
+        left_vertex_index = argmin(xs)
+        left = Point(*points_to_process[left_vertex_index])
+        del points_to_process[left_vertex_index]
+
+        right = Point(*points_to_process[0])
+
+        # Find line on the left side
+        line_l = Line(left, top)
+        # Find line on the right side
+        line_r = Line(top, right)
+
+    elif tri_type == TriType.STANDARD:
+        points_sorted_vertically = sorted([p1, p2, p3], key=lambda p: p.y)
+        pBottom = points_sorted_vertically[0]
+        pMiddle = points_sorted_vertically[1]
+        pTop = points_sorted_vertically[2]
+
+        opposite_line = Line(pBottom, pTop)
+        new_x = opposite_line.x(pMiddle.y)
+        pNew = Point(new_x, pMiddle.y, z_origin + dz_dx * new_x + dz_dy * pMiddle.y)
+        topTri = [pMiddle.as_tuple(), pNew.as_tuple(), pTop.as_tuple()]
+        botTri = [pMiddle.as_tuple(), pNew.as_tuple(), pBottom.as_tuple()]
+
+        # both halves are on the same plane
+        draw_tri(topTri, color, pixel_buffer, z_buffer, depth_plane)
+        draw_tri(botTri, color, pixel_buffer, z_buffer, depth_plane)
+        return
+
+    else:
+        raise Exception("I don't know how to draw anything else")
+
+    # the cartesian extent of the buffer
+    x_first = -z_buffer.origin_x
+    x_last = z_buffer.width - z_buffer.origin_x - 1
+    y_first = max(m.ceil(y_min), z_buffer.origin_y - z_buffer.height + 1)
+    y_last = min(m.floor(y_max), z_buffer.origin_y)
+
+    # depth at x = 0 on each row, one step of dz_dy per row
+    row_z = z_origin + dz_dy * y_first
+    for y in range(y_first, y_last + 1):
+        span_start = max(m.ceil(line_l.x(y)), x_first)
+        span_end = min(m.floor(line_r.x(y)), x_last)
+        if span_start <= span_end:
+            z = row_z + dz_dx * np.arange(span_start, span_end + 1)
+            x, row = z_buffer.cartesian_to_index(span_start, y)
+            visible = z <= z_buffer.contents[row, x : x + len(z)]
+            pixel_buffer.set_span(x, row, len(z), color, visible)
+            z_buffer.set_span(x, row, len(z), z, visible)
+        row_z += dz_dy
+
+
+def edge_function(ax, ay, bx, by, px, py):
+    """twice the signed area of (a, b, p), positive when p is left of a->b.
+    px and py can be numpy arrays to evaluate many points at once"""
+    return (bx - ax) * (py - ay) - (by - ay) * (px - ax)
+
+
+def draw_tri_edge(
+    tri: list[tuple[float, float, float]],
+    color: int,
+    pixel_buffer: Buffer,
+    z_buffer: Buffer,
+):
+    """Alternative to draw_tri: evaluates the barycentric edge functions over
+    the triangle's bounding box as numpy arrays, giving the coverage mask and
+    interpolated depth for every pixel in one shot"""
+    (x1, y1, z1), (x2, y2, z2), (x3, y3, z3) = (tuple(p[:3]) for p in tri)
+
+    area = edge_function(x1, y1, x2, y2, x3, y3)
+    if area == 0:
+        # degenerate triangle, nothing to draw
+        return
+
+    # bounding box in cartesian coordinates, clipped to the buffer
+    origin_x = pixel_buffer.origin_x
+    origin_y = pixel_buffer.origin_y
+    x_min = max(m.ceil(min(x1, x2, x3)), -origin_x)
+    x_max = min(m.floor(max(x1, x2, x3)), pixel_buffer.width - origin_x - 1)
+    y_min = max(m.ceil(min(y1, y2, y3)), origin_y - pixel_buffer.height + 1)
+    y_max = min(m.floor(max(y1, y2, y3)), origin_y)
+    if x_min > x_max or y_min > y_max:
+        return
+
+    xs = np.arange(x_min, x_max + 1, dtype=float)
+    # buffer rows go down the screen, so walk y from the top of the box
+    ys = np.arange(y_max, y_min - 1, -1, dtype=float)[:, np.newaxis]
+
+    # dividing by the signed area makes the weights winding independent
+    w1 = edge_function(x2, y2, x3, y3, xs, ys) / area
+    w2 = edge_function(x3, y3, x1, y1, xs, ys) / area
+    w3 = edge_function(x1, y1, x2, y2, xs, ys) / area
+
+    covered = (w1 >= 0) & (w2 >= 0) & (w3 >= 0)
+    z = z1 * w1 + z2 * w2 + z3 * w3
+
+    left, top = z_buffer.cartesian_to_index(x_min, y_max)
+    z_block = z_buffer.contents[top : top + len(ys), left : left + len(xs)]
+    visible = covered & (z <= z_block)
+
+    pixel_buffer.set_masked(left, top, visible, color)
+    z_buffer.set_masked(left, top, visible, z)
+
+
+def tri_bounds(tris: TriArray, buffer: Buffer):
+    """left, right, top and bottom buffer index of the pixels each triangle
+    could cover, the same bounding box draw_tri_edge uses. not clipped to
+    the buffer, so they can be past its edges"""
+    x = tris[:, :, 0]
+    y = tris[:, :, 1]
+    left = np.ceil(x.min(axis=1)) + buffer.origin_x
+    right = np.floor(x.max(axis=1)) + buffer.origin_x
+    top = buffer.origin_y - np.floor(y.max(axis=1))
+    bottom = buffer.origin_y - np.ceil(y.min(axis=1))
+    return left, right, top, bottom
+
+
+def dirty_rect(tris: TriArray, buffer: Buffer) -> tuple[int, int, int, int]:
+    """(x, y, width, height) of the part of the buffer drawing tris can
+    change, the union of their bounding boxes. 0 wide when nothing can"""
+    if len(tris) == 0:
+        return (0, 0, 0, 0)
+    left, right, top, bottom = tri_bounds(np.asarray(tris), buffer)
+    x = max(int(left.min()), 0)
+    y = max(int(top.min()), 0)
+    x_end = min(int(right.max()) + 1, buffer.width)
+    y_end = min(int(bottom.max()) + 1, buffer.height)
+    if x >= x_end or y >= y_end:
+        return (0, 0, 0, 0)
+    return (x, y, x_end - x, y_end - y)
+
+
+def draw_tris(
+    tris: TriArray,
+    colors: list[int],
+    pixel_buffer: Buffer,
+    z_buffer: Buffer,
+    rasterize=draw_tri_edge,
+):
+    """draw each triangle with rasterize, cycling through colors"""
+    for i, tri in enumerate(tris):
+        try:
+            rasterize(tri, colors[i % len(colors)], pixel_buffer, z_buffer)
+        except Exception as e:
+            pass
+            # print(f"couldn't draw tri: {tri=}")
+            # print(f"an error occured: {e}")
+            # traceback.print_exc()
+
+
+@dataclasses.dataclass
+class CullStats:
+    """what cull_tris did with the triangles it was given"""
+
+    total: int = 0
+    # facing away from the camera, or edge on
+    backfacing: int = 0
+    # entirely off the screen or outside the near/far planes
+    offscreen: int = 0
+    # crossed the near or far plane and were cut down to fit
+    clipped: int = 0
+    # left to rasterize, including the extra triangles clipping makes
+    drawn: int = 0
+
+
+def signed_areas(tris: TriArray) -> npt.NDArray[np.float64]:
+    """twice the signed screen space area of each triangle"""
+    a, b, c = tris[:, 0], tris[:, 1], tris[:, 2]
+    return edge_function(a[:, 0], a[:, 1], b[:, 0], b[:, 1], c[:, 0], c[:, 1])
+
+
+def clip_to_plane(tris: TriArray, face_ids, distances):
+    """clip triangles to the side of a plane where distances >= 0.
+    distances is the signed distance of each vertex from the plane, (M,3).
+    a triangle with one vertex inside becomes a smaller triangle, one with
+    two inside becomes a quad split into two triangles"""
+    inside = distances >= 0
+    num_inside = inside.sum(axis=1)
+    one_inside = num_inside == 1
+    two_inside = num_inside == 2
+
+    def rotate(selected, first):
+        """reorder the vertices of the selected triangles so the vertex at
+        index first comes first, keeping their winding"""
+        rows = np.nonzero(selected)[0][:, np.newaxis]
+        order = (first[:, np.newaxis] + np.arange(3)) % 3
+        return tris[rows, order], distances[rows, order]
+
+    def intersect(p1, p2, d1, d2):
+        return p1 + (p2 - p1) * (d1 / (d1 - d2))[:, np.newaxis]
+
+    # the inside vertex first, then cut the edges leaving it
+    (a, b, c), (da, db, dc) = (
+        np.moveaxis(x, 1, 0)
+        for x in rotate(one_inside, np.argmax(inside[one_inside], axis=1))
+    )
+    one_tris = np.stack([a, intersect(a, b, da, db), intersect(a, c, da, dc)], axis=1)
+
+    # the outside vertex first, then cut the edges to and from it
+    (c, a, b), (dc, da, db) = (
+        np.moveaxis(x, 1, 0)
+        for x in rotate(two_inside, np.argmin(inside[two_inside], axis=1))
+    )
+    ca = intersect(c, a, dc, da)
+    cb = intersect(c, b, dc, db)
+    quad_tris = [np.stack([ca, a, b], axis=1), np.stack([ca, b, cb], axis=1)]
+
+    all_inside = num_inside == 3
+    clipped_tris = np.concatenate([tris[all_inside], one_tris, *quad_tris])
+    clipped_face_ids = np.concatenate(
+        [
+            face_ids[all_inside],
+            face_ids[one_inside],
+            face_ids[two_inside],
+            face_ids[two_inside],
+        ]
+    )
+    return clipped_tris, clipped_face_ids, int(one_inside.sum() + two_inside.sum())
+
+
+def cull_tris(
+    tris: TriArray,
+    width: int,
+    height: int,
+    near: float = -np.inf,
+    far: float = np.inf,
+    cull_backfaces: bool = True,
+):
+    """Remove triangles that can't be seen before they are rasterized,
+    working on the whole triangle array at once.
+
+    Returns the triangles left, the index in tris each one came from (to
+    look up its color) and CullStats. Triangles that are only partly off
+    the side of the screen are kept, draw_tri_edge clips those to the
+    buffer. Smaller z is closer, so near < far.
+
+    cull_backfaces needs a mesh with consistent winding, like the obj
+    models, the hand made cubes aren't.
+    """
+    stats = CullStats(total=len(tris))
+    face_ids = np.arange(len(tris))
+
+    if cull_backfaces:
+        # smaller z is closer, so front faces wind clockwise on screen
+        front = signed_areas(tris) < 0
+        stats.backfacing = int(np.count_nonzero(~front))
+        tris = tris[front]
+        face_ids = face_ids[front]
+
+    # the cartesian extent of the buffer, as draw_tri_edge sees it
+    xs, ys, zs = tris[:, :, 0], tris[:, :, 1], tris[:, :, 2]
+    offscreen = (
+        (xs.max(axis=1) < -(width // 2))
+        | (xs.min(axis=1) > width - width // 2 - 1)
+        | (ys.max(axis=1) < height // 2 - height + 1)
+        | (ys.min(axis=1) > height // 2)
+        | (zs.max(axis=1) < near)
+        | (zs.min(axis=1) > far)
+    )
+    stats.offscreen = int(np.count_nonzero(offscreen))
+    tris = tris[~offscreen]
+    face_ids = face_ids[~offscreen]
+
+    # counted before clipping, so a triangle crossing both planes, or split
+    # by the first, still only counts once
+    zs = tris[:, :, 2]
+    crossing = (zs.min(axis=1) < near) | (zs.max(axis=1) > far)
+    stats.clipped = int(np.count_nonzero(crossing))
+    if np.isfinite(near):
+        tris, face_ids, _ = clip_to_plane(tris, face_ids, tris[:, :, 2] - near)
+    if np.isfinite(far):
+        tris, face_ids, _ = clip_to_plane(tris, face_ids, far - tris[:, :, 2])
+
+    stats.drawn = len(tris)
+    return tris, face_ids, stats
+
+
+def create_down_square_tris(
+    num_tris: int, width: int = WIDTH, height: int = HEIGHT
+) -> list[list[tuple[int, int]]]:
+    test_tris = []
+    for _ in range(num_tris):
+        rand_x1 = random.randint(-width // 2, width // 2)
+        rand_x2 = random.randint(-width // 2, width // 2)
+        xmin = min(rand_x1, rand_x2)
+        xmax = max(rand_x1, rand_x2)
+        if xmin == xmax:
+            xmax += 1
+
+        rand_y1 = random.randint(-height // 2, height // 2)
+        rand_y2 = random.randint(-height // 2, height // 2)
+        ymin = min(rand_y1, rand_y2)
+        ymax = max(rand_y1, rand_y2)
+        if ymin == ymax:
+            ymax += 1
+
+        x1 = xmin
+        y1 = ymax
+        x2 = xmax
+        y2 = ymax
+        x3 = random.choice([xmax, xmin])
+        y3 = ymin
+
+        tri = [(x1, y1), (x2, y2), (x3, y3)]
+        random.shuffle(tri)
+
+        test_tris.append(tri)
+    return test_tris
+
+
+def create_down_tris(
+    num_tris: int, width: int = WIDTH, height: int = HEIGHT
+) -> list[list[tuple[int, int]]]:
+    test_tris = []
+    for _ in range(num_tris):
+        rand_x1 = random.randint(-width // 2, width // 2)
+        rand_x2 = random.randint(-width // 2, width // 2)
+        rand_x3 = random.randint(-width // 2, width // 2)
+        xmin = min(rand_x1, rand_x2)
+        xmax = max(rand_x1, rand_x2)
+        if xmin == xmax:
+            xmax += 1
+
+        rand_y1 = random.randint(-height // 2, height // 2)
+        rand_y2 = random.randint(-height // 2, height // 2)
+        ymin = min(rand_y1, rand_y2)
+        ymax = max(rand_y1, rand_y2)
+        if ymin == ymax:
+            ymax += 1
+
+        x1 = xmin
+        y1 = ymax
+        x2 = xmax
+        y2 = ymax
+        x3 = rand_x3
+        y3 = ymin
+
+        tri = [(x1, y1), (x2, y2), (x3, y3)]
+        random.shuffle(tri)
+
+        test_tris.append(tri)
+    return test_tris
+
+
+def create_up_tris(
+    num_tris: int, width: int = WIDTH, height: int = HEIGHT
+) -> list[list[tuple[int, int]]]:
+    test_tris = []
+    for _ in range(num_tris):
+        rand_x1 = random.randint(-width // 2, width // 2)
+        rand_x2 = random.randint(-width // 2, width // 2)
+        rand_x3 = random.randint(-width // 2, width // 2)
+        xmin = min(rand_x1, rand_x2)
+        xmax = max(rand_x1, rand_x2)
+        if xmin == xmax:
+            xmax += 1
+
+        rand_y1 = random.randint(-height // 2, height // 2)
+        rand_y2 = random.randint(-height // 2, height // 2)
+        ymin = min(rand_y1, rand_y2)
+        ymax = max(rand_y1, rand_y2)
+        if ymin == ymax:
+            ymax += 1
+
+        x1 = xmin
+        y1 = ymin
+        x2 = xmax
+        y2 = ymin
+        x3 = rand_x3
+        y3 = ymax
+
+        tri = [(x1, y1), (x2, y2), (x3, y3)]
+        random.shuffle(tri)
+
+        test_tris.append(tri)
+    return test_tris
+
+
+def create_standard_tris(
+    num_tris: int, width: int = WIDTH, height: int = HEIGHT
+) -> list[list[tuple[int, int]]]:
+    test_tris = []
+    for _ in range(num_tris):
+        x1 = random.randint(-width // 2, width // 2)
+        x2 = random.randint(-width // 2, width // 2)
+        x3 = random.randint(-width // 2, width // 2)
+
+        y1 = random.randint(-height // 2, height // 2)
+        y2 = random.randint(-height // 2, height // 2)
+        y3 = random.randint(-height // 2, height // 2)
+
+        tri = [(x1, y1), (x2, y2), (x3, y3)]
+        random.shuffle(tri)
+
+        test_tris.append(tri)
+    return test_tris
+
+
+# z pos
+# back 100
+# middle 60
+# front 20
+niave_cube_verts: VertArray = np.array(
+    [
+        (*vec, 1.0)
+        for vec in [
+            (40, 30, 60),
+            (0, -40, 20),
+            (-40, -20, 60),
+            (0, 0, 100),
+            (40, -20, 60),
+            (0, 10, 20),
+            (-40, 30, 60),
+            (0, 50, 100),
+        ]
+    ],
+    dtype=float,
+)
+
+niave_cube_faces: FaceArray = np.array(
+    [
+        [1, 4, 3],
+        [1, 2, 3],  # bottom
+        [5, 0, 4],
+        [5, 1, 4],  # front right
+        [5, 6, 2],
+        [5, 1, 2],  # front left
+        [2, 6, 7],
+        [2, 3, 7],  # back left
+        [3, 7, 0],
+        [3, 4, 0],  # back right
+        [5, 6, 7],
+        [5, 0, 7],  # top
+    ],
+    dtype=np.intp,
+)
+
+cube_verts: VertArray = np.array(
+    [
+        (*vec, 1.0)
+        for vec in [
+            (0, 0, 0),
+            (0, 0, 1),
+            (0, 1, 0),
+            (0, 1, 1),
+            (1, 0, 0),
+            (1, 0, 1),
+            (1, 1, 0),
+            (1, 1, 1),
+        ]
+    ],
+    dtype=float,
+)
+
+
+cube_faces: FaceArray = np.array(
+    [
+        [0, 1, 2],  # x 0 face
+        [1, 2, 3],
+        [4, 5, 6],  # x 1 face
+        [5, 6, 7],
+        [0, 1, 4],  # y 0 face
+        [1, 4, 5],
+        [2, 3, 6],  # y 1 face
+        [3, 6, 7],
+        [0, 2, 4],  # z 0 face
+        [2, 4, 6],
+        [1, 3, 5],  # z 1 face
+        [3, 5, 7],
+    ],
+    dtype=np.intp,
+)
+
+
+cube_colors = [
+    pyxel.COLOR_PINK,
+    pyxel.COLOR_PINK,
+    pyxel.COLOR_LIGHT_BLUE,
+    pyxel.COLOR_LIGHT_BLUE,
+    pyxel.COLOR_LIME,
+    pyxel.COLOR_LIME,
+    pyxel.COLOR_YELLOW,
+    pyxel.COLOR_YELLOW,
+    pyxel.COLOR_PURPLE,
+    pyxel.COLOR_PURPLE,
+    pyxel.COLOR_GRAY,
+    pyxel.COLOR_GRAY,
+]
+
+test_colors = [
+    pyxel.COLOR_PINK,
+    pyxel.COLOR_PURPLE,
+]
+
+test_faces: FaceArray = np.array(
+    [
+        [0, 1, 2],
+        [0, 2, 4],
+    ],
+    dtype=np.intp,
+)
+
+# old_cube_tris = [
+#     [(0, 0), (0, -40), (40, -20)],
+#     [(0, 0), (0, -40), (-40, -20)],  # bottom
+#     [(0, 10), (40, 30), (40, -20)],
+#     [(0, 10), (0, -40), (40, -20)],  # front right
+#     [(0, 10), (-40, 30), (-40, -20)],
+#     [(0, 10), (0, -40), (-40, -20)],  # front left
+#     [(0, 0), (40, -20), (40, 30)],
+#     [(0, 0), (0, 50), (40, 30)],  # back right
+#     [(0, 0), (-40, -20), (-40, 30)],
+#     [(0, 0), (0, 50), (-40, 30)],  # back left
+#     [(0, 50), (0, 10), (40, 30)],
+#     [(0, 10), (0, 10), (-40, 30)],  # bottom
+# ]
+
+# test_tris = [[(11, 11), (1, 11), (1, 1)], [(20, 60), (0, 60), (20, 20)]]
+# test_tris = create_down_tris(30)
+# test_tris = [[(-25,-25),(50,50),(5,60)]]
+# test_tris = create_standard_tris(30)
+
+
+# angles are wrapped to a turn and rounded to this many decimal places to look
+# them up, so angles that only differ by float error share a matrix
+matrix_key_decimals = 9
+matrix_cache_size = 1024
+
+
+def cached_matrix(period=None):
+    """decorator for the create* functions, so each matrix is only built once
+    and kept in an LRU cache. with a period the parameters are angles, which
+    are wrapped and rounded to look them up, so a spin reuses its matrices
+    every turn. other parameters are looked up exactly. a matrix is always
+    built from the first caller's parameters. the matrices are shared,
+    which makes them read only"""
+
+    def decorate(create):
+        cache: collections.OrderedDict[tuple, Mat4] = collections.OrderedDict()
+
+        @functools.wraps(create)
+        def create_cached(*params):
+            if period is None:
+                key = tuple(float(param) for param in params)
+            else:
+                key = tuple(
+                    round(float(param) % period, matrix_key_decimals)
+                    for param in params
+                )
+            matrix = cache.get(key)
+            if matrix is None:
+                matrix = create(*params)
+                matrix.flags.writeable = False
+                cache[key] = matrix
+                if len(cache) > matrix_cache_size:
+                    cache.popitem(last=False)
+            else:
+                cache.move_to_end(key)
+            return matrix
+
+        create_cached.cache_clear = cache.clear
+        return create_cached
+
+    return decorate
+
+
+@cached_matrix(period=2 * m.pi)
+def createRotationX(angle):
+    return np.array(
+        [
+            [m.cos(angle), m.sin(angle), 0.0, 0.0],
+            [-m.sin(angle), m.cos(angle), 0.0, 0.0],
+            [0.0, 0.0, 1.0, 0.0],
+            [0.0, 0.0, 0.0, 1.0],
+        ],
+        dtype=float,
+    )
+
+
+@cached_matrix(period=2 * m.pi)
+def createRotationZ(angle):
+    return np.array(
+        [
+            [1.0, 0.0, 0.0, 0.0],
+            [0.0, m.cos(angle), m.sin(angle), 0.0],
+            [0.0, -m.sin(angle), m.cos(angle), 0.0],
+            [0.0, 0.0, 0.0, 1.0],
+        ],
+        dtype=float,
+    )
+
+
+@cached_matrix(period=2 * m.pi)
+def createRotationY(angle):
+    return np.array(
+        [
+            [m.cos(angle), 0.0, m.sin(angle), 0.0],
+            [0.0, 1.0, 0.0, 0.0],
+            [-m.sin(angle), 0.0, m.cos(angle), 0.0],
+            [0.0, 0.0, 0.0, 1.0],
+        ],
+        dtype=float,
+    )
+
+
+@cached_matrix()
+def createTranslation(x, y, z):
+    return np.array(
+        [
+            [1.0, 0.0, 0.0, x],
+            [0.0, 1.0, 0.0, y],
+            [0.0, 0.0, 1.0, z],
+            [0.0, 0.0, 0.0, 1.0],
+        ],
+        dtype=float,
+    )
+
+
+@cached_matrix()
+def createScale(xf, yf, zf):
+    return np.array(
+        [
+            [xf, 0.0, 0.0, 0.0],
+            [0.0, yf, 0.0, 0.0],
+            [0.0, 0.0, zf, 0.0],
+            [0.0, 0.0, 0.0, 1.0],
+        ],
+        dtype=float,
+    )
+
+
+def rotation_stack(angles, first: int, second: int):
+    """(F,4,4) rotations in the plane of two axes, one for each angle"""
+    angles = np.asarray(angles, dtype=float)
+    cos = np.cos(angles)
+    sin = np.sin(angles)
+    rotations = np.zeros(angles.shape + (4, 4))
+    rotations[..., [0, 1, 2, 3], [0, 1, 2, 3]] = 1.0
+    rotations[..., first, first] = cos
+    rotations[..., first, second] = sin
+    rotations[..., second, first] = -sin
+    rotations[..., second, second] = cos
+    return rotations
+
+
+# the same matrices as the create* functions, for a whole array of parameters
+# at once, like every frame of an animation
+
+
+def createRotationsX(angles):
+    return rotation_stack(angles, 0, 1)
+
+
+def createRotationsZ(angles):
+    return rotation_stack(angles, 1, 2)
+
+
+def createRotationsY(angles):
+    return rotation_stack(angles, 0, 2)
+
+
+def createTranslations(offsets):
+    """offsets is (F,3)"""
+    offsets = np.asarray(offsets, dtype=float)
+    translations = np.zeros(offsets.shape[:-1] + (4, 4))
+    translations[..., [0, 1, 2, 3], [0, 1, 2, 3]] = 1.0
+    translations[..., :3, 3] = offsets
+    return translations
+
+
+def createScales(factors):
+    """factors is (F,3)"""
+    factors = np.asarray(factors, dtype=float)
+    scales = np.zeros(factors.shape[:-1] + (4, 4))
+    scales[..., [0, 1, 2], [0, 1, 2]] = factors
+    scales[..., 3, 3] = 1.0
+    return scales
+
+
+identity = np.array(
+    [
+        [1.0, 0.0, 0.0, 0.0],
+        [0.0, 1.0, 0.0, 0.0],
+        [0.0, 0.0, 1.0, 0.0],
+        [0.0, 0.0, 0.0, 1.0],
+    ],
+    dtype=float,
+)
+rot90z = np.array(
+    [
+        [0.0, 1.0, 0.0, 0.0],
+        [-1.0, 0.0, 0.0, 0.0],
+        [0.0, 0.0, 1.0, 0.0],
+        [0.0, 0.0, 0.0, 1.0],
+    ],
+    dtype=float,
+)
+
+rot90x = np.array(
+    [
+        [1.0, 0.0, 0.0, 0.0],
+        [0.0, 0.0, 1.0, 0.0],
+        [0.0, -1.0, 0.0, 0.0],
+        [0.0, 0.0, 0.0, 1.0],
+    ],
+    dtype=float,
+)
+
+# TODO: don't hard code palette
+# print("Palette color 15")
+# print(pyxel.colors[15])
+# red = pyxel.colors[15]//(256*256)
+# green = (pyxel.colors[15]//256)%256
+# blue = pyxel.colors[15]%256
+# print(red, green, blue)
+colors_rgb = [
+    (0, 0, 0),
+    (43, 51, 95),
+    (126, 32, 114),
+    (25, 149, 156),
+    (139, 72, 82),
+    (57, 92, 152),
+    (169, 193, 255),
+    (238, 238, 238),
+    (212, 24, 108),
+    (211, 132, 65),
+    (233, 195, 91),
+    (112, 198, 169),
+    (118, 150, 222),
+    (163, 163, 163),
+    (255, 151, 152),
+    (237, 199, 176),
+]
+transform = rot90x
+
+
+def palette_lut(palette, bits=5, exclude=()) -> np.ndarray:
+    """(2**bits, 2**bits, 2**bits) table of the nearest palette color
+    to each rgb value, with every channel cut down to its top bits"""
+    levels = 2**bits
+    # the middle of each bucket of 8 bit values
+    values = (np.arange(levels) + 0.5) * 256 / levels
+    rgb = np.stack(np.meshgrid(values, values, values, indexing="ij"), axis=-1)
+    distances = ((rgb[..., None, :] - np.array(palette)) ** 2).sum(axis=-1)
+    distances[..., list(exclude)] = np.inf
+    return distances.argmin(axis=-1).astype(np.uint8)
+
+
+# 0 is the background and is transparent in gifs, so nothing is shaded with it
+colors_lut = palette_lut(colors_rgb, exclude=[0])
+
+
+def nearest_palette_colors(rgb: np.ndarray, lut: np.ndarray = colors_lut):
+    """palette index of each rgb color, from 0 to 1, as a uint8 array"""
+    bits = len(lut).bit_length() - 1
+    channels = np.clip(np.asarray(rgb) * 256, 0, 255).astype(np.intp) >> (8 - bits)
+    return lut[channels[..., 0], channels[..., 1], channels[..., 2]]
+
+
+def turntable_transform(frame_count: int, total_scale: float = 80.0) -> Mat4:
+    """spin around the y axis, one turn every 100 frames"""
+    # matrix multiplaction order is left to right
+    return createRotationY(m.pi / 50 * frame_count + 10) @ createScale(
+        total_scale, total_scale, total_scale
+    )
+
+
+@dataclasses.dataclass
+class Camera:
+    """A perspective camera. view moves the world so the camera is at the
+    origin looking down +z, projection takes that to clip space with the
+    distance in front of the camera in w, and after dividing by w viewport
+    takes it to the cartesian pixels the rasterizers use.
+
+    Depth comes out as normalized device z, 0 on the near plane and 1 on the
+    far one, so smaller is still closer. It is linear in screen space, so
+    the rasterizers interpolate it across a triangle like before."""
+
+    # None puts the camera on the -z axis, far enough back that the z = 0
+    # plane is a scene unit per pixel, the same size as without a camera
+    position: tuple[float, float, float] | None = None
+    target: tuple[float, float, float] = (0.0, 0.0, 0.0)
+    up: tuple[float, float, float] = (0.0, 1.0, 0.0)
+    # vertical field of view in radians
+    fov: float = m.radians(60)
+    near: float = 1.0
+    far: float = 1000.0
+    width: int = WIDTH
+    height: int = HEIGHT
+
+    def __post_init__(self):
+        if self.position is None:
+            self.position = (0.0, 0.0, -self.height / 2 / m.tan(self.fov / 2))
+
+    def view(self) -> Mat4:
+        # __post_init__ has filled in the default position
+        assert self.position is not None
+        forward = np.subtract(self.target, self.position)
+        forward /= np.linalg.norm(forward)
+        right = np.cross(self.up, forward)
+        right /= np.linalg.norm(right)
+        up = np.cross(forward, right)
+        rotation = np.eye(4)
+        rotation[:3, :3] = [right, up, forward]
+        return rotation @ createTranslation(*np.negative(self.position))
+
+    def projection(self) -> Mat4:
+        focal_length = 1 / m.tan(self.fov / 2)
+        depth_scale = self.far / (self.far - self.near)
+        return np.array(
+            [
+                [focal_length * self.height / self.width, 0.0, 0.0, 0.0],
+                [0.0, focal_length, 0.0, 0.0],
+                [0.0, 0.0, depth_scale, -self.near * depth_scale],
+                [0.0, 0.0, 1.0, 0.0],
+            ]
+        )
+
+    def viewport(self) -> Mat4:
+        return createScale(self.width / 2, self.height / 2, 1.0)
+
+    def clip_matrix(self) -> Mat4:
+        """world to clip space"""
+        return self.projection() @ self.view()
+
+    def project(self, clip_verts: VertArray, out: VertArray | None = None):
+        """divide clip space vertices by w and map them to pixels, once per
+        vertex. w is kept, vertices behind the camera are left undivided
+        and have to be clipped away first"""
+        if out is None:
+            out = np.empty_like(clip_verts)
+        w = clip_verts[:, 3:]
+        out[:] = clip_verts
+        np.divide(out, w, out=out, where=w > 0)
+        out[:, :3] *= [self.width / 2, self.height / 2, 1.0]
+        out[:, 3:] = w
+        return out
+
+    def clip_tris(self, clip_tris, face_ids):
+        """clip triangles in clip space to the near and far planes, and
+        project what is left to (M,3,3) screen triangles"""
+        near_distances = clip_tris[:, :, 2]
+        clip_tris, face_ids, _ = clip_to_plane(clip_tris, face_ids, near_distances)
+        far_distances = clip_tris[:, :, 3] - clip_tris[:, :, 2]
+        clip_tris, face_ids, _ = clip_to_plane(clip_tris, face_ids, far_distances)
+        screen_verts = self.project(clip_tris.reshape(-1, 4))
+        return screen_verts[:, :3].reshape(-1, 3, 3), face_ids
+
+
+def turntable_transforms(frame_counts, total_scale: float = 80.0):
+    """(F,4,4) turntable_transform of every frame count at once"""
+    frame_counts = np.asarray(frame_counts, dtype=float)
+    return createRotationsY(m.pi / 50 * frame_counts + 10) @ createScale(
+        total_scale, total_scale, total_scale
+    )
+
+
+class TransformStage:
+    """Transforms meshes into preallocated arrays that are reused every frame"""
+
+    transformed_verts: VertArray
+    render_tris: TriArray
+    # the face each of render_tris came from, counting across instances
+    face_ids: npt.NDArray[np.intp]
+    # face_ids when nothing was clipped
+    all_face_ids: npt.NDArray[np.intp]
+    # before the perspective divide, with a camera
+    clip_verts: VertArray
+
+    def __init__(self) -> None:
+        self.transformed_verts = np.empty((0, 4))
+        self.clip_verts = np.empty((0, 4))
+        self.render_tris = np.empty((0, 3, 3))
+        self.all_face_ids = np.empty(0, dtype=np.intp)
+        self.face_ids = self.all_face_ids
+
+    def reserve(self, num_verts: int, num_tris: int):
+        """make sure the outputs have room for the scene,
+        only allocating when the scene size changes"""
+        if len(self.transformed_verts) != num_verts:
+            self.transformed_verts = np.empty((num_verts, 4))
+        if len(self.render_tris) != num_tris:
+            self.render_tris = np.empty((num_tris, 3, 3))
+        if len(self.all_face_ids) != num_tris:
+            self.all_face_ids = np.arange(num_tris)
+
+    def render_instances(
+        self, verts, faces, transforms, camera: Camera | None = None
+    ) -> TriArray:
+        """transform a copy of the mesh for each transform into the
+        preallocated outputs, one after another. transforms is a list or a
+        (K,4,4) array, and every instance is done in one batched multiply.
+
+        with a camera the triangles are projected to the screen. ones that
+        cross the near or far plane are clipped, which can change how many
+        there are, face_ids says which face each one is"""
+        transforms = np.asarray(transforms, dtype=float).reshape(-1, 4, 4)
+        num_instances = len(transforms)
+        num_verts = len(verts)
+        num_tris = len(faces)
+        self.reserve(num_verts * num_instances, num_tris * num_instances)
+        self.face_ids = self.all_face_ids
+
+        # views of the outputs with an axis for the instances
+        instance_verts = self.transformed_verts.reshape(num_instances, num_verts, 4)
+        instance_tris = self.render_tris.reshape(num_instances, num_tris, 3, 3)
+        if camera is None:
+            transform_verts(verts, transforms, out=instance_verts)
+        else:
+            if len(self.clip_verts) != len(self.transformed_verts):
+                self.clip_verts = np.empty_like(self.transformed_verts)
+            transform_verts(
+                verts,
+                camera.clip_matrix() @ transforms,
+                out=self.clip_verts.reshape(num_instances, num_verts, 4),
+            )
+            camera.project(self.clip_verts, out=self.transformed_verts)
+        tris_from_verts(instance_verts, faces, out=instance_tris)
+
+        if camera is None:
+            return self.render_tris
+        return self.clip_to_camera(faces, num_instances, num_verts, camera)
+
+    def clip_to_camera(self, faces, num_instances, num_verts, camera: Camera):
+        """swap the triangles outside the near or far plane for their
+        clipped pieces, keeping the rest in place"""
+        w = self.clip_verts[:, 3]
+        clip_z = self.clip_verts[:, 2]
+        outside = (clip_z < 0) | (clip_z > w)
+        if not outside.any():
+            return self.render_tris
+
+        instance_faces = faces + num_verts * np.arange(num_instances)[:, None, None]
+        instance_faces = instance_faces.reshape(-1, 3)
+        crossing = outside[instance_faces].any(axis=1)
+        clipped_tris, clipped_ids = camera.clip_tris(
+            self.clip_verts[instance_faces[crossing]], np.flatnonzero(crossing)
+        )
+        self.face_ids = np.concatenate([np.flatnonzero(~crossing), clipped_ids])
+        return np.concatenate([self.render_tris[~crossing], clipped_tris])
+
+
+# unit vector pointing at the light, from the top left in front of the model.
+# the camera looks down +z, so faces toward it have normals with negative z
+light_direction = np.array([-1.0, 1.0, -1.0]) / m.sqrt(3)
+# how bright faces turned away from the light are
+ambient = 0.3
+shade_levels = 8
+
+
+def face_normals(verts: VertArray, faces: FaceArray) -> npt.NDArray[np.float64]:
+    """(M,3) unit normal of each face, pointing out of a front face"""
+    tris = tris_from_verts(verts, faces)
+    normals = np.cross(tris[:, 1] - tris[:, 0], tris[:, 2] - tris[:, 0])
+    lengths = np.linalg.norm(normals, axis=1, keepdims=True)
+    # degenerate faces have no direction, leave them as zero
+    return np.divide(normals, lengths, out=np.zeros_like(normals), where=lengths > 0)
+
+
+def transform_normals(normals, transform: Mat4) -> npt.NDArray[np.float64]:
+    """normals of a mesh after it is transformed, which have to go through
+    the inverse transpose so scaling doesn't bend them"""
+    normal_matrix = np.swapaxes(np.linalg.inv(transform[..., :3, :3]), -1, -2)
+    transformed = normals @ np.swapaxes(normal_matrix, -1, -2)
+    lengths = np.linalg.norm(transformed, axis=-1, keepdims=True)
+    return np.divide(
+        transformed, lengths, out=np.zeros_like(transformed), where=lengths > 0
+    )
+
+
+def lambert(normals, light=light_direction) -> npt.NDArray[np.float64]:
+    """how directly each face faces the light, from 0 to 1"""
+    return np.clip(normals @ light, 0, 1)
+
+
+def light_instances(normals, transforms) -> npt.NDArray[np.float64]:
+    """lambert intensity of every face of each instance, in the same order
+    as render_instances"""
+    transforms = np.asarray(transforms, dtype=float).reshape(-1, 4, 4)
+    return lambert(transform_normals(normals, transforms)).reshape(-1)
+
+
+def shade_ramps(
+    palette=colors_rgb, levels=shade_levels, ambient=ambient, lut=colors_lut
+) -> npt.NDArray[np.uint8]:
+    """(len(palette), levels) table of the palette color to draw each base
+    color with, from facing away from the light to facing it"""
+    brightness = ambient + (1 - ambient) * np.linspace(0, 1, levels)
+    rgb = np.array(palette)[:, None, :] / 255 * brightness[:, None]
+    return nearest_palette_colors(rgb, lut)
+
+
+colors_ramps = shade_ramps()
+
+
+def shade_colors(base_colors, intensities, ramps=colors_ramps):
+    """palette color of each face, lit with the nearest shade of its
+    base color"""
+    levels = ramps.shape[1]
+    shades = np.rint(intensities * (levels - 1)).astype(np.intp)
+    return ramps[base_colors, shades]
+
+
+# 4x4 ordered dithering thresholds, between 0 and 1
+bayer_matrix = (
+    np.array([[0, 8, 2, 10], [12, 4, 14, 6], [3, 11, 1, 9], [15, 7, 13, 5]]) + 0.5
+) / 16
+
+
+def dither_shades(
+    face_buffer: Buffer,
+    base_colors,
+    intensities,
+    pixel_buffer: Buffer,
+    ramps=colors_ramps,
+):
+    """fill pixel_buffer from a buffer of face ids, -1 for nothing drawn.
+    each pixel picks between the two shades either side of its face's
+    intensity with the bayer matrix, so faces get in between shades"""
+    levels = ramps.shape[1]
+    shades = intensities * (levels - 1)
+    darker = np.minimum(shades.astype(np.intp), levels - 2)
+    lighter_fraction = shades - darker
+
+    face_ids = face_buffer.contents
+    covered = face_ids >= 0
+    height, width = face_ids.shape
+    tiles = (-(-height // 4), -(-width // 4))
+    thresholds = np.tile(bayer_matrix, tiles)[:height, :width]
+
+    ids = face_ids[covered]
+    lighter = lighter_fraction[ids] > thresholds[covered]
+    pixel_buffer.fill()
+    pixel_buffer.contents[covered] = ramps[
+        np.asarray(base_colors)[ids], darker[ids] + lighter
+    ]
+
+
+def box_filter(pixels, factor: int, palette=colors_rgb, lut=colors_lut):
+    """shrink an image of palette colors by factor in each direction,
+    averaging the rgb of each factor x factor block. blocks that are
+    mostly background stay background"""
+    height = pixels.shape[0] // factor
+    width = pixels.shape[1] // factor
+    blocks = pixels[: height * factor, : width * factor]
+
+    def block_sums(values):
+        return values[blocks].reshape(height, factor, width, factor).sum(axis=(1, 3))
+
+    # sum each channel on its own, a float rgb image would be huge
+    palette = np.asarray(palette, dtype=np.uint16)
+    rgb = np.stack([block_sums(palette[:, i]) for i in range(3)], axis=-1)
+    colors = nearest_palette_colors(rgb / (255 * factor**2), lut)
+
+    background = block_sums(np.arange(len(palette)) == 0) * 2 > factor**2
+    colors[background] = 0
+    return colors
+
+
+class RenderTarget:
+    """A frame drawn at its own size. Scenes are laid out for a WIDTH x HEIGHT
+    screen and get scaled up to fit the width of the target.
+
+    A supersampled target draws supersample times bigger in each direction,
+    and box filters back down to its size for the finished frame."""
+
+    width: int
+    height: int
+    supersample: int
+    # pixels drawn per scene unit
+    scale: float
+    pixel_buffer: Buffer
+    z_buffer: Buffer
+    # only made when dithering
+    face_buffer: Buffer | None = None
+
+    def __init__(
+        self,
+        width: int = WIDTH,
+        height: int = HEIGHT,
+        supersample: int = 1,
+        origin: tuple[int, int] | None = None,
+        tiler=None,
+    ):
+        """origin is the pixel the scene's (0, 0) goes on, the middle by
+        default. a tiler draws in tiles into its own buffers, which have
+        to be the drawing size"""
+        self.width = width
+        self.height = height
+        self.supersample = supersample
+        self.scale = supersample * width / WIDTH
+        self.tiler = tiler
+
+        drawing_size = (width * supersample, height * supersample)
+        if tiler is None:
+            self.pixel_buffer = Buffer(*drawing_size, 0)
+            self.z_buffer = Buffer(*drawing_size, float("inf"), dtype=np.float32)
+        else:
+            self.pixel_buffer = tiler.pixel_buffer
+            self.z_buffer = tiler.z_buffer
+            if (self.pixel_buffer.width, self.pixel_buffer.height) != drawing_size:
+                raise ValueError(f"the tiler has to be {drawing_size} pixels")
+
+        if origin is not None:
+            for buffer in (self.pixel_buffer, self.z_buffer):
+                buffer.origin_x = origin[0] * supersample
+                buffer.origin_y = origin[1] * supersample
+        self.scaled_tris = np.empty((0, 3, 3))
+
+    def clear(self):
+        self.pixel_buffer.fill()
+        self.z_buffer.fill()
+
+    def fit(self, tris: TriArray) -> TriArray:
+        """tris scaled from scene units to this target's pixels, depth is
+        left alone. reuses the same array each frame"""
+        if len(self.scaled_tris) != len(tris):
+            self.scaled_tris = np.empty((len(tris), 3, 3))
+        np.multiply(tris, [self.scale, self.scale, 1.0], out=self.scaled_tris)
+        return self.scaled_tris
+
+    def draw_tris(self, tris: TriArray, colors, rasterize=draw_tri_edge):
+        tris = self.fit(tris)
+        if self.tiler is not None:
+            self.tiler.draw_tris(tris, colors, rasterize)
+        else:
+            draw_tris(tris, colors, self.pixel_buffer, self.z_buffer, rasterize)
+
+    def draw_dithered(
+        self,
+        tris: TriArray,
+        face_ids,
+        base_colors,
+        intensities,
+        rasterize=draw_tri_edge,
+    ):
+        """draw the faces lit with dither_shades"""
+        if self.face_buffer is None:
+            self.face_buffer = Buffer(
+                self.pixel_buffer.width, self.pixel_buffer.height, -1, dtype=np.int32
+            )
+            self.face_buffer.origin_x = self.pixel_buffer.origin_x
+            self.face_buffer.origin_y = self.pixel_buffer.origin_y
+        self.face_buffer.fill()
+        draw_tris(self.fit(tris), face_ids, self.face_buffer, self.z_buffer, rasterize)
+        dither_shades(self.face_buffer, base_colors, intensities, self.pixel_buffer)
+
+    def frame(self) -> npt.NDArray[np.uint8]:
+        """the finished frame, width x height. without supersampling this is
+        the pixel buffer itself, copy it to keep it"""
+        if self.supersample == 1:
+            return self.pixel_buffer.contents
+        return box_filter(self.pixel_buffer.contents, self.supersample)
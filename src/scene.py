@@ -0,0 +1,156 @@
+"""A scene graph. Nodes have a transform relative to their parent, children,
+and optionally a shape to draw.
+
+World transforms are cached on each node and only worked out again after a
+transform above them changes. Every node drawing the same shape shares its
+arrays, and they are all transformed in one batch.
+
+root = Node()
+arm = root.add(Node(transform=createTranslation(40, 0, 0)))
+arm.add(Node(cube))
+frame = Scene(root).render()
+"""
+
+import dataclasses
+
+import numpy as np
+import numpy.typing as npt
+
+from renderer import (
+    Camera,
+    FaceArray,
+    Mat4,
+    TransformStage,
+    TriArray,
+    VertArray,
+    face_normals,
+    identity,
+    light_instances,
+)
+
+
+class Shape:
+    """A mesh any number of nodes can draw, with a palette color for each
+    face, cycled through like draw_tris does"""
+
+    def __init__(self, verts: VertArray, faces: FaceArray, colors):
+        self.verts = verts
+        self.faces = faces
+        self.colors = np.resize(np.asarray(colors), len(faces))
+        self.normals = face_normals(verts, faces)
+
+
+class Node:
+    """A transform relative to the parent node, and the world transform it
+    adds up to. Change the transform with set_transform, so the cached
+    world transforms below it know to update"""
+
+    parent: "Node | None" = None
+    # the world transform needs working out again
+    dirty: bool = True
+
+    def __init__(self, shape: Shape | None = None, transform: Mat4 = identity):
+        self.shape = shape
+        self.transform = transform
+        self.world = identity
+        self.children: list[Node] = []
+
+    def add(self, child: "Node") -> "Node":
+        """make child one of this node's children, taking it away from the
+        parent it had"""
+        if child.parent is not None:
+            child.parent.children.remove(child)
+        child.parent = self
+        self.children.append(child)
+        child.mark_dirty()
+        return child
+
+    def set_transform(self, transform: Mat4):
+        self.transform = transform
+        self.mark_dirty()
+
+    def mark_dirty(self):
+        # a node is only clean once everything above it is, so a dirty
+        # node's children are already dirty
+        if self.dirty:
+            return
+        self.dirty = True
+        for child in self.children:
+            child.mark_dirty()
+
+    def world_transform(self) -> Mat4:
+        if self.dirty:
+            if self.parent is None:
+                self.world = self.transform
+            else:
+                self.world = self.parent.world_transform() @ self.transform
+            self.dirty = False
+        return self.world
+
+    def walk(self):
+        """this node and every node below it, parents first"""
+        yield self
+        for child in self.children:
+            yield from child.walk()
+
+
+@dataclasses.dataclass
+class SceneFrame:
+    """everything render_instances and light_instances give the app, for a
+    whole scene"""
+
+    tris: TriArray
+    # the face each triangle came from, indexing colors and intensities
+    face_ids: npt.NDArray[np.intp]
+    # palette color and lambert intensity of every face of every node
+    colors: npt.NDArray[np.uint8]
+    intensities: npt.NDArray[np.float64]
+
+
+class Scene:
+    """Draws the nodes under root, one batch per shape. Each shape keeps a
+    TransformStage, so its arrays are reused between frames"""
+
+    def __init__(self, root: Node | None = None):
+        self.root = Node() if root is None else root
+        self.stages: dict[Shape, TransformStage] = {}
+
+    def render(self, camera: Camera | None = None) -> SceneFrame:
+        """the arrays can be the stage's, which are reused next frame"""
+        instances: dict[Shape, list[Mat4]] = {}
+        for node in self.root.walk():
+            if node.shape is not None:
+                instances.setdefault(node.shape, []).append(node.world_transform())
+
+        tris, face_ids, colors, intensities = [], [], [], []
+        num_faces = 0
+        for shape, transforms in instances.items():
+            stage = self.stages.setdefault(shape, TransformStage())
+            tris.append(
+                stage.render_instances(shape.verts, shape.faces, transforms, camera)
+            )
+            face_ids.append(stage.face_ids + num_faces)
+            colors.append(np.tile(shape.colors, len(transforms)))
+            intensities.append(light_instances(shape.normals, transforms))
+            num_faces += len(shape.faces) * len(transforms)
+
+        # shapes nobody draws any more don't need their arrays
+        for shape in self.stages.keys() - instances.keys():
+            del self.stages[shape]
+
+        if not tris:
+            return SceneFrame(
+                np.empty((0, 3, 3)),
+                np.empty(0, dtype=np.intp),
+                np.empty(0, dtype=np.uint8),
+                np.empty(0),
+            )
+        if len(tris) == 1:
+            # the stage's own arrays, so one shape doesn't copy anything
+            return SceneFrame(tris[0], face_ids[0], colors[0], intensities[0])
+        return SceneFrame(
+            np.concatenate(tris),
+            np.concatenate(face_ids),
+            np.concatenate(colors),
+            np.concatenate(intensities),
+        )
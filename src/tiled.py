@@ -0,0 +1,184 @@
+"""Rasterize the screen in tiles, spread over several processes.
+
+Triangles are binned into the tiles their bounding boxes touch, and each tile
+draws its triangles in their original order, clipped to the tile. Tiles
+don't overlap, so the result is the same as drawing every triangle in one
+go, just split up.
+
+That isn't free: a triangle is set up and rasterized again for every tile it
+touches, clipped to that tile. Big triangles on small tiles can touch dozens
+of tiles, and then tiling only beats drawing serially with at least that
+many cores to share the work. Bigger tiles mean fewer repeats but less to
+share out, benchmark.py tiles measures both.
+"""
+
+import multiprocessing
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from renderer import Buffer, TriArray, draw_tri_edge, draw_tris, tri_bounds
+from worker_pool import spawn_pool
+
+# set in each worker process by attach_buffers
+worker_buffers: dict[str, Buffer] = {}
+worker_memory: list[shared_memory.SharedMemory] = []
+
+
+def bin_tris(tris: TriArray, buffer: Buffer, tile_size: int):
+    """(tile index, triangle indices) of every tile with triangles in it.
+    tiles are numbered across then down, triangles keep their order"""
+    tiles_x = -(-buffer.width // tile_size)
+
+    left, right, top, bottom = tri_bounds(tris, buffer)
+    on_screen = (
+        (right >= 0)
+        & (left < buffer.width)
+        & (bottom >= 0)
+        & (top < buffer.height)
+        & (left <= right)
+        & (top <= bottom)
+    )
+    ids = np.flatnonzero(on_screen)
+
+    first_x = np.clip(left[ids], 0, buffer.width - 1).astype(np.intp) // tile_size
+    last_x = np.clip(right[ids], 0, buffer.width - 1).astype(np.intp) // tile_size
+    first_y = np.clip(top[ids], 0, buffer.height - 1).astype(np.intp) // tile_size
+    last_y = np.clip(bottom[ids], 0, buffer.height - 1).astype(np.intp) // tile_size
+
+    # one entry for every tile each triangle touches
+    across = last_x - first_x + 1
+    counts = across * (last_y - first_y + 1)
+    tri_ids = np.repeat(ids, counts)
+    nth = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    tile_x = np.repeat(first_x, counts) + nth % np.repeat(across, counts)
+    tile_y = np.repeat(first_y, counts) + nth // np.repeat(across, counts)
+    tile_ids = tile_y * tiles_x + tile_x
+
+    # a stable sort keeps each tile's triangles in drawing order
+    order = np.argsort(tile_ids, kind="stable")
+    tile_ids = tile_ids[order]
+    tri_ids = tri_ids[order]
+    starts = np.flatnonzero(np.diff(tile_ids, prepend=-1))
+    return [
+        (int(tile_ids[start]), tri_ids[start:end])
+        for start, end in zip(starts, [*starts[1:], len(tile_ids)])
+    ]
+
+
+def tile_rect(tile: int, buffer: Buffer, tile_size: int):
+    """left, top, width and height of a tile, smaller at the edges"""
+    tiles_x = -(-buffer.width // tile_size)
+    left = tile % tiles_x * tile_size
+    top = tile // tiles_x * tile_size
+    width = min(tile_size, buffer.width - left)
+    height = min(tile_size, buffer.height - top)
+    return left, top, width, height
+
+
+def draw_tiles(jobs, pixel_buffer: Buffer, z_buffer: Buffer, rasterize):
+    """draw each (rect, tris, colors) job into its rectangle of the buffers"""
+    for rect, tris, colors in jobs:
+        draw_tris(
+            tris, colors, pixel_buffer.view(*rect), z_buffer.view(*rect), rasterize
+        )
+
+
+def attach_buffers(layouts):
+    """worker initializer, maps the shared buffers into this process"""
+    for name, (memory_name, shape, dtype, initial_value) in layouts.items():
+        memory = shared_memory.SharedMemory(memory_name)
+        worker_memory.append(memory)
+        contents = np.ndarray(shape, dtype=dtype, buffer=memory.buf)
+        worker_buffers[name] = Buffer.wrap(contents, initial_value)
+
+
+def draw_tiles_in_worker(jobs, rasterize, origin):
+    """origin is the buffers' cartesian origin, which can have been moved
+    since the worker attached them, like a RenderTarget does"""
+    pixel_buffer = worker_buffers["pixels"]
+    z_buffer = worker_buffers["depth"]
+    for buffer in (pixel_buffer, z_buffer):
+        buffer.origin_x, buffer.origin_y = origin
+    draw_tiles(jobs, pixel_buffer, z_buffer, rasterize)
+
+
+class TiledRasterizer:
+    """Color and depth buffers in shared memory, drawn into by a pool of
+    worker processes a group of tiles at a time.
+
+    With workers=1 the tiles are drawn in this process, which is handy to
+    check the tiling without the pool."""
+
+    pixel_buffer: Buffer
+    z_buffer: Buffer
+
+    def __init__(self, width, height, tile_size=64, workers=None):
+        self.tile_size = tile_size
+        self.workers = workers or multiprocessing.cpu_count()
+        self.memory = []
+        layouts = {}
+        for name, initial_value, dtype in [
+            ("pixels", 0, np.uint8),
+            ("depth", float("inf"), np.float32),
+        ]:
+            shape = (height, width)
+            memory = shared_memory.SharedMemory(
+                create=True, size=int(np.prod(shape)) * np.dtype(dtype).itemsize
+            )
+            self.memory.append(memory)
+            contents = np.ndarray(shape, dtype=dtype, buffer=memory.buf)
+            contents.fill(initial_value)
+            layouts[name] = (memory.name, shape, dtype, initial_value)
+            if name == "pixels":
+                self.pixel_buffer = Buffer.wrap(contents, initial_value)
+            else:
+                self.z_buffer = Buffer.wrap(contents, initial_value)
+
+        self.pool = None
+        if self.workers > 1:
+            self.pool = spawn_pool(
+                self.workers, initializer=attach_buffers, initargs=(layouts,)
+            )
+
+    def draw_tris(self, tris: TriArray, colors, rasterize=draw_tri_edge):
+        """draw_tris into the shared buffers, one tile at a time.
+        rasterize has to clip to the buffer it is given, like draw_tri_edge
+        and draw_tri do"""
+        tris = np.asarray(tris)
+        # cycle through colors the same way draw_tris does
+        colors = np.resize(np.asarray(colors), len(tris))
+        jobs = [
+            (tile_rect(tile, self.pixel_buffer, self.tile_size), tris[ids], colors[ids])
+            for tile, ids in bin_tris(tris, self.pixel_buffer, self.tile_size)
+        ]
+        if self.pool is None:
+            draw_tiles(jobs, self.pixel_buffer, self.z_buffer, rasterize)
+            return
+
+        # a few batches per worker, so busy tiles don't hold everyone up
+        num_batches = min(len(jobs), self.workers * 4)
+        batches = [jobs[i::num_batches] for i in range(num_batches)]
+        origin = (self.pixel_buffer.origin_x, self.pixel_buffer.origin_y)
+        for done in [
+            self.pool.submit(draw_tiles_in_worker, batch, rasterize, origin)
+            for batch in batches
+        ]:
+            done.result()
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+        # the buffers point into the shared memory, so drop them first
+        del self.pixel_buffer, self.z_buffer
+        for memory in self.memory:
+            memory.close()
+            memory.unlink()
+        self.memory = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
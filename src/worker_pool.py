@@ -0,0 +1,14 @@
+"""Process pools for the gif encoders and the tiled rasterizer."""
+
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+
+def spawn_pool(workers=None, **kwargs) -> ProcessPoolExecutor:
+    """a ProcessPoolExecutor whose workers are spawned rather than forked.
+    a forked worker would inherit the app's window and renderer state, a
+    spawned one starts a fresh interpreter and only imports what it runs.
+    kwargs go to ProcessPoolExecutor"""
+    return ProcessPoolExecutor(
+        workers, mp_context=multiprocessing.get_context("spawn"), **kwargs
+    )
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# the modules in src import each other as top level modules, like when they
+# are run from the repo root
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
@@ -0,0 +1,102 @@
+import math as m
+
+import numpy as np
+import pytest
+
+from renderer import (
+    Buffer,
+    Point,
+    createRotationY,
+    createScale,
+    createTranslation,
+    cull_tris,
+    draw_tri,
+    z_estimate,
+)
+
+
+def drawn_depths(tri, size=200):
+    """(x, y, depth) of every pixel draw_tri covers, in cartesian coordinates"""
+    pixel_buffer = Buffer(size, size, 0)
+    z_buffer = Buffer(size, size, float("inf"), dtype=np.float64)
+    draw_tri(tri, 1, pixel_buffer, z_buffer)
+    rows, columns = np.nonzero(np.isfinite(z_buffer.contents))
+    xs = columns - z_buffer.origin_x
+    ys = z_buffer.origin_y - rows
+    return xs, ys, z_buffer.contents[rows, columns]
+
+
+def assert_depths_match_z_estimate(tri):
+    xs, ys, depths = drawn_depths(tri)
+    assert len(depths)
+    corners = [Point(*corner) for corner in tri]
+    expected = [z_estimate(*corners, Point(x, y, 0)) for x, y in zip(xs, ys)]
+    depth_range = np.ptp([corner[2] for corner in tri])
+    np.testing.assert_allclose(depths, expected, rtol=0, atol=1e-9 * depth_range + 1e-9)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_stepped_depth_matches_z_estimate(seed):
+    rng = np.random.default_rng(seed)
+    tri = [tuple(corner) for corner in rng.uniform(-120, 120, (3, 3))]
+    assert_depths_match_z_estimate(tri)
+
+
+@pytest.mark.parametrize(
+    "tri",
+    [
+        # long and thin, corner to corner
+        [(-99.5, -99.5, -40.0), (99.5, 99.2, 60.0), (0.3, 0.6, 5.0)],
+        # almost flat along x
+        [(-90.2, 9.7, 1.0), (90.7, 10.4, -1.0), (0.1, 10.9, 30.0)],
+        # almost flat along y
+        [(5.1, -95.3, 10.0), (5.6, 97.8, -10.0), (6.4, 0.2, 0.0)],
+        # nearly collinear, with steep depth
+        [(-80.0, -40.0, -500.0), (80.0, 40.1, 500.0), (0.0, 1.5, 250.0)],
+    ],
+)
+def test_sliver_depth_matches_z_estimate(tri):
+    assert_depths_match_z_estimate(tri)
+
+
+def test_cached_matrices_keep_small_parameters():
+    scale = createScale(1e-10, 1e-10, 1e-10)
+    np.testing.assert_array_equal(np.diag(scale), [1e-10, 1e-10, 1e-10, 1.0])
+    assert createScale(1e-10, 1e-10, 1e-10) is scale
+    assert createScale(2e-10, 2e-10, 2e-10)[0, 0] == 2e-10
+    assert createTranslation(1e-12, 0, 0)[0, 3] == 1e-12
+
+
+def test_cached_rotations_repeat_every_turn():
+    angle = 0.1
+    rotation = createRotationY(angle)
+    assert createRotationY(angle + 2 * np.pi) is rotation
+    np.testing.assert_array_equal(
+        rotation,
+        [
+            [m.cos(angle), 0, m.sin(angle), 0],
+            [0, 1, 0, 0],
+            [-m.sin(angle), 0, m.cos(angle), 0],
+            [0, 0, 0, 1],
+        ],
+    )
+    with pytest.raises(ValueError):
+        rotation[0, 0] = 2.0
+
+
+def test_cull_stats_count_each_clipped_triangle_once():
+    rng = np.random.default_rng(0)
+    tris = rng.uniform([-80, -60, -100], [80, 60, 100], (200, 3, 3))
+    near, far = -30.0, 30.0
+    kept_tris, face_ids, stats = cull_tris(tris, 160, 120, near, far)
+
+    zs = tris[:, :, 2]
+    crossing = (zs.min(axis=1) < near) | (zs.max(axis=1) > far)
+    assert 0 < stats.clipped <= stats.total
+    assert stats.clipped == len(
+        np.intersect1d(np.unique(face_ids), np.flatnonzero(crossing))
+    )
+    assert stats.drawn == len(kept_tris)
+    assert np.all(
+        (kept_tris[:, :, 2] >= near - 1e-9) & (kept_tris[:, :, 2] <= far + 1e-9)
+    )
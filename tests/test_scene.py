@@ -0,0 +1,52 @@
+import numpy as np
+
+from renderer import createTranslation
+from scene import Node, Scene, Shape
+
+triangle = Shape(
+    np.array([[0.0, 0.0, 0.0, 1.0], [10.0, 0.0, 0.0, 1.0], [0.0, 10.0, 0.0, 1.0]]),
+    np.array([[0, 1, 2]]),
+    [3],
+)
+
+
+def test_sibling_change_keeps_cached_world_transform():
+    root = Node()
+    still = root.add(Node(transform=createTranslation(5, 0, 0)))
+    leaf = still.add(Node(triangle))
+    moving = root.add(Node(triangle))
+    Scene(root).render()
+    world = leaf.world
+
+    moving.set_transform(createTranslation(0, 7, 0))
+    assert not still.dirty and not leaf.dirty
+    Scene(root).render()
+    assert leaf.world is world
+    np.testing.assert_array_equal(moving.world_transform()[:3, 3], [0, 7, 0])
+
+
+def test_add_moves_a_node_from_its_old_parent():
+    root = Node()
+    first = root.add(Node(transform=createTranslation(5, 0, 0)))
+    second = root.add(Node(transform=createTranslation(0, 5, 0)))
+    leaf = first.add(Node(triangle))
+    second.add(leaf)
+
+    assert first.children == [] and second.children == [leaf]
+    frame = Scene(root).render()
+    assert len(frame.tris) == 1
+    np.testing.assert_array_equal(leaf.world_transform()[:3, 3], [0, 5, 0])
+
+
+def test_frame_colors_tile_each_shape():
+    square = Shape(
+        np.array([[0, 0, 0, 1], [1, 0, 0, 1], [1, 1, 0, 1], [0, 1, 0, 1]], dtype=float),
+        np.array([[0, 1, 2], [0, 2, 3]]),
+        [4, 5],
+    )
+    root = Node()
+    for _ in range(3):
+        root.add(Node(square))
+    root.add(Node(triangle))
+    frame = Scene(root).render()
+    np.testing.assert_array_equal(frame.colors, [4, 5, 4, 5, 4, 5, 3])
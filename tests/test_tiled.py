@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+
+import tiled
+from renderer import HEIGHT, WIDTH, RenderTarget, cube_colors, draw_tri, draw_tri_edge
+
+
+def random_tris(num_tris, seed=0):
+    """small triangles scattered over the scene, at random depths"""
+    rng = np.random.default_rng(seed)
+    centers = rng.uniform(
+        [-WIDTH / 2, -HEIGHT / 2, -50], [WIDTH / 2, HEIGHT / 2, 50], (num_tris, 1, 3)
+    )
+    offsets = rng.uniform([-20, -20, -5], [20, 20, 5], (num_tris, 3, 3))
+    return centers + offsets
+
+
+@pytest.mark.parametrize("rasterize", [draw_tri_edge, draw_tri])
+@pytest.mark.parametrize("workers", [1, 2])
+@pytest.mark.parametrize("origin", [None, (10, 90)])
+def test_tiled_matches_serial(workers, origin, rasterize):
+    tris = random_tris(300)
+    width, height = WIDTH * 2, HEIGHT * 2
+    serial = RenderTarget(width, height, origin=origin)
+    serial.draw_tris(tris, cube_colors, rasterize)
+    assert np.count_nonzero(serial.pixel_buffer.contents)
+
+    with tiled.TiledRasterizer(width, height, tile_size=32, workers=workers) as tiler:
+        target = RenderTarget(width, height, origin=origin, tiler=tiler)
+        target.draw_tris(tris, cube_colors, rasterize)
+        np.testing.assert_array_equal(
+            target.pixel_buffer.contents, serial.pixel_buffer.contents
+        )
+        np.testing.assert_array_equal(
+            target.z_buffer.contents, serial.z_buffer.contents
+        )